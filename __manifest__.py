@@ -1,6 +1,6 @@
 {
     "name": "Copia Partner",
-    "version": "1.0",
+    "version": "1.1",
     "category": "Sale",
     "sequence": 80,
     "author": "Muratha & Musa",
@@ -25,8 +25,14 @@ Customizations to Partner(base)
         "views/res_partner_territory_view.xml",
         "views/res_partner_location_view.xml",
         "views/res_partner_location_type_view.xml",
-        "data/res_partner_data.xml"
+        "views/res_country_view.xml",
+        "views/res_partner_stats_view.xml",
+        "data/res_partner_data.xml",
+        "data/ir_cron_data.xml"
     ],
+    "external_dependencies": {
+        "python": ["numpy"],
+    },
     "installable": True,
     "auto_install": False
 }
@@ -1,3 +1,8 @@
+from . import account
+from . import hierarchy
+from . import res_country
 from . import res_partner
 from . import location
 from . import territory
+from . import route
+from . import stats
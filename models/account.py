@@ -0,0 +1,47 @@
+from odoo import api, models, tools
+
+
+class AccountAccount(models.Model):
+    _inherit = "account.account"
+
+    # Fields deciding agent.type._get_receivable_account_id
+    _receivable_fields = {"user_type_id", "internal_type", "deprecated", "company_id"}
+
+    @api.model
+    def create(self, vals):
+        account = super(AccountAccount, self).create(vals)
+        self.env["agent.type"].clear_caches()
+        return account
+
+    @api.multi
+    def write(self, vals):
+        res = super(AccountAccount, self).write(vals)
+        if self._receivable_fields.intersection(vals):
+            self.env["agent.type"].clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(AccountAccount, self).unlink()
+        self.env["agent.type"].clear_caches()
+        return res
+
+
+class AccountInvoice(models.Model):
+    _inherit = "account.invoice"
+
+    @api.model_cr
+    def init(self):
+        super(AccountInvoice, self).init()
+        # Serves the Night-to-Pay aggregate of res.partner.action_sms_night_to_pay: the
+        # predicate matches its WHERE clause and the summed amounts are carried in the
+        # index so the nightly run is an index only scan of one day of invoices
+        if not tools.index_exists(self._cr, "account_invoice_night_to_pay_index"):
+            if self._cr._cnx.server_version >= 110000:
+                columns = "(date_invoice, partner_id) INCLUDE (amount_total, residual)"
+            else:
+                columns = "(date_invoice, partner_id, amount_total, residual)"
+            self._cr.execute("""
+                CREATE INDEX account_invoice_night_to_pay_index ON account_invoice {}
+                WHERE type = 'out_invoice' AND state != 'cancel'
+            """.format(columns))
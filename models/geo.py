@@ -0,0 +1,91 @@
+"""
+Geohash and great-circle distance helpers for partner coordinates. Geohashes
+share a prefix when they are close, which lets a plain B-tree on the geohash
+answer radius queries without PostGIS.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# ~5m cells, stored on res.partner.data
+GEOHASH_PRECISION = 9
+
+_base32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    :return: the geohash of the point e.g "kzf0tk5rb" for Nairobi
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit, even = [], 0, 0, True
+    while len(chars) < precision:
+        bounds, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits, bounds[0] = bits * 2 + 1, mid
+        else:
+            bits, bounds[1] = bits * 2, mid
+        even, bit = not even, bit + 1
+        if bit == 5:
+            chars.append(_base32[bits])
+            bits, bit = 0, 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision):
+    """
+    :return: (height, width) in degrees of the cells of a precision
+    """
+    lat_bits, lon_bits = 5 * precision // 2, (5 * precision + 1) // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def geohash_cover(latitude, longitude, radius_km):
+    """
+    Geohash prefixes whose cells cover the circle around the point: the cell of
+    the point and its 8 neighbours, at the finest precision whose cells are at
+    least radius_km high and wide.
+    :return: list of prefixes, or None when the radius is too large to narrow the search
+    """
+    # Degrees of longitude shrink towards the poles, take the poleward edge of the circle
+    cos_lat = math.cos(math.radians(min(90.0, abs(latitude) + radius_km / KM_PER_DEGREE)))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        if min(height * KM_PER_DEGREE, width * KM_PER_DEGREE * cos_lat) >= radius_km:
+            break
+    else:
+        return None
+
+    prefixes = set()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            lat = max(-90.0, min(90.0, latitude + dy * height))
+            lon = (longitude + dx * width + 180.0) % 360.0 - 180.0
+            prefixes.add(geohash_encode(lat, lon, precision))
+    return sorted(prefixes)
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great-circle distance in km, element-wise over NumPy arrays (or scalars)
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+
+def haversine_sql(latitude_column, longitude_column):
+    """
+    SQL expression of the great-circle distance in km between the columns and
+    a point. It takes the positional parameters (latitude, latitude, longitude).
+    """
+    return """
+        2 * {radius} * asin(sqrt(least(1.0,
+            power(sin(radians({lat} - %s) / 2), 2) +
+            cos(radians(%s)) * cos(radians({lat})) * power(sin(radians({lon} - %s) / 2), 2)
+        )))
+    """.format(radius=EARTH_RADIUS_KM, lat=latitude_column, lon=longitude_column)
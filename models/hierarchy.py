@@ -0,0 +1,90 @@
+from odoo import api, models, tools
+from odoo.tools.cache import STAT
+
+
+class PartnerHierarchyMixin(models.AbstractModel):
+    """
+    In-process cache of a parent_id tree (territories, locations) shared by all
+    users of a database. It is loaded lazily in one query and dropped on any
+    unlink or write touching the tree; clear_caches() bumps the registry cache
+    signalling sequence so the other workers drop their copy as well. Creating a
+    record changes no cached entry and keeps the cache, so that imports do not
+    reload the tree and the registry caches once per row. name_get reads the
+    stored full path instead.
+    """
+    _name = "res.partner.hierarchy.mixin"
+    _description = "Partner Hierarchy Cache"
+
+    @api.model
+    @tools.ormcache()
+    def _get_hierarchy(self):
+        """
+        Loads the whole tree
+        :return: dict of id to (parent_id, name, full path)
+        """
+        self._cr.execute('SELECT id, parent_id, name FROM "%s"' % self._table)
+        nodes = {node_id: (parent_id, name) for node_id, parent_id, name in self._cr.fetchall()}
+
+        paths = {}
+        for node_id in nodes:
+            # Walk up to the first ancestor with a known path, then fill the chain
+            chain, current = [], node_id
+            while current in nodes and current not in paths:
+                chain.append(current)
+                current = nodes[current][0]
+            path = paths.get(current)
+            for node in reversed(chain):
+                path = path and "%s / %s" % (path, nodes[node][1]) or nodes[node][1]
+                paths[node] = path
+
+        return {node_id: (parent_id, name, paths[node_id]) for node_id, (parent_id, name) in nodes.items()}
+
+    @api.model
+    def _get_subtree_query(self, ids):
+        """
+        SQL selecting the ids of the records in the subtrees of ``ids``. Descendants
+        of a node are the paths in [path, path || ':'), paths only holding digits
+        and '/' which both sort below ':', so each root is an indexed range scan on
+        parent_path (text_pattern_ops)
+        :return: (query, params)
+        """
+        return """
+            SELECT c.id FROM "{table}" c
+            JOIN "{table}" r ON c.parent_path ~>=~ r.parent_path AND c.parent_path ~<~ r.parent_path || ':'
+            WHERE r.id IN %s
+        """.format(table=self._table), [tuple(ids) or (None,)]
+
+    @api.model
+    def get_hierarchy_cache_stats(self):
+        """
+        Hit/miss counters of the hierarchy cache for this model in this process
+        :return: dict with hit and miss counts
+        """
+        stats = {"hit": 0, "miss": 0}
+        for (db_name, model_name, method), counter in STAT.items():
+            if db_name == self.pool.db_name and model_name == self._name and method.__name__ == "_get_hierarchy":
+                stats["hit"] += counter.hit
+                stats["miss"] += counter.miss
+        return stats
+
+    @api.multi
+    def _get_full_names(self):
+        """
+        :return: dict of id to full path, taken from the hierarchy cache; records
+            created since it was loaded are left out
+        """
+        hierarchy = self._get_hierarchy()
+        return {record.id: hierarchy[record.id][2] for record in self if record.id in hierarchy}
+
+    @api.multi
+    def write(self, vals):
+        res = super(PartnerHierarchyMixin, self).write(vals)
+        if 'name' in vals or 'parent_id' in vals:
+            self.clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(PartnerHierarchyMixin, self).unlink()
+        self.clear_caches()
+        return res
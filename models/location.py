@@ -1,43 +1,79 @@
-from odoo import api, models, fields, _
-from odoo.exceptions import UserError, ValidationError
+from odoo import api, models, fields, tools, _
+from odoo.exceptions import ValidationError
 from odoo.osv import expression
 
+from .utils import check_exclude_constraints, create_trigram_index
+
 
 class PartnerLocation(models.Model):
     _name = "res.partner.location"
+    _inherit = ["res.partner.hierarchy.mixin"]
     _description = "Partner Location Information"
 
 
     @api.multi
-    @api.depends('partner_ids','agent_count')
+    def _read_descendant_agents(self, aggregate):
+        '''
+        Aggregates the agents (res.partner.data) of each location's subtree
+        :param aggregate: SQL aggregate over the agent rows ``d`` e.g COUNT(d.id)
+        :return: dict of location id to the aggregated value
+        '''
+        locations = self.filtered('id')
+        if not locations:
+            return {}
+        # Descendants of a location are the paths in [path, path || ':'); paths
+        # only hold digits and '/', both sorting below ':', so the range is an
+        # indexed scan on parent_path (text_pattern_ops)
+        self._cr.execute("""
+            SELECT l.id, {aggregate}
+            FROM res_partner_location l
+            JOIN res_partner_location c
+                ON c.parent_path ~>=~ l.parent_path AND c.parent_path ~<~ l.parent_path || ':'
+            JOIN res_partner_data d ON d.location_id = c.id
+            WHERE l.id IN %s
+            GROUP BY l.id
+        """.format(aggregate=aggregate), (tuple(locations.ids),))
+        return dict(self._cr.fetchall())
+
+    @api.multi
     def _compute_agent_count(self):
         '''
-        Computes the number of agents in a location
+        Computes the number of agents in each location's subtree
         :return:
         '''
+        counts = self._read_descendant_agents("COUNT(d.id)")
+        for location in self:
+            location.agent_count = counts.get(location.id, 0)
 
-        #Get the location id and sort in ascending order
-        ids = self.ids
-        ids.sort()
-        size = len(ids)
-        #Begin getting agents from last location in the list
-        location_list = self._get_list(self.env['res.partner.location'].search([('id', '=', ids[size - 1])]))
-        agent_list = []
-        #populate agents from location
-        while len(location_list) > 0:
-            if self.env['res.partner.data'].search([('location_id', 'in', location_list)]):
-                agent_list = agent_list + self._get_list(
-                    self.env['res.partner.data'].search([('location_id', 'in', location_list)]))
-            location_list = self._get_list(
-                self.env['res.partner.location'].search([('parent_id', 'in', location_list)]))
-
-        #Add agents to list
-        loc = self.env['res.partner.location'].search([('id','=', ids[size-1])])
-        loc.partner_ids = str(agent_list)
-        #Saves agent_count to variable
-        loc.agent_count = len(agent_list)
+    @api.multi
+    def _compute_partner_ids(self):
+        '''
+        Computes the agents in each location's subtree
+        :return:
+        '''
+        agents = self._read_descendant_agents("array_agg(d.id)")
+        partner_data = self.env['res.partner.data']
+        for location in self:
+            location.partner_ids = partner_data.browse(agents.get(location.id, []))
 
-        return True
+    @api.multi
+    def get_visit_order(self, start=None, time_budget=2.0):
+        """
+        Visit route through the agents in the location's subtree
+        :return: see res.partner.route.get_visit_order
+        """
+        self.ensure_one()
+        agents = self.env['res.partner.data'].search([('location_id', 'child_of', self.id)])
+        return self.env['res.partner.route'].get_visit_order(agents.ids, start=start, time_budget=time_budget)
+
+    @api.depends('parent_id.parent_path')
+    def _compute_parent_path(self):
+        '''
+        Materialized ancestor path e.g 1/5/23/ for location 23 under 5 under 1
+        :return:
+        '''
+        for location in self:
+            location.parent_path = "%s%s/" % (location.parent_id.parent_path or "", location.id)
 
     @api.multi
     def get_agents(self):
@@ -45,9 +81,8 @@ class PartnerLocation(models.Model):
         Returns a view with all agents in that location
         :return:
         """
-        import json
-        partner_ids = json.loads(self.partner_ids)
-        if len(partner_ids) > 0:
+        self.ensure_one()
+        if self.agent_count > 0:
             return {
                 'name': _('Agents'),
                 'view_type': 'form',
@@ -55,37 +90,65 @@ class PartnerLocation(models.Model):
                 'res_model': 'res.partner.data',
                 'type': 'ir.actions.act_window',
                 'context': {},
-                'domain': [('id', 'in', partner_ids)],
+                'domain': [('location_id', 'child_of', self.id)],
             }
 
-
-    def _get_list(self, collection):
-        """
-        Get a list of ID when given a list of objects
-        :param collection:
-        :return: list of ids
-        """
-        collection_list = []
-        for data in collection:
-            collection_list.append(data.id)
-        return collection_list
-
     name = fields.Char("Name", required=True)
     parent_id = fields.Many2one("res.partner.location", "Parent", index=True, ondelete="cascade")
     active = fields.Boolean("active")
     location_ids = fields.One2many('res.partner.data', 'location_id', string='Locations')
     agent_count = fields.Integer("Agent Count", compute='_compute_agent_count', store=False)
-    partner_ids = fields.Char("Agent Count", compute='_compute_agent_count', store=False)
-    location_name = fields.Char("Display Name")
-
-    @api.constrains("name")
-    def _check_unique_name(self):
-        if self.search([("name", "=", self.name), ("id", "!=", self.id)]):
-            raise UserError(
-                _(
-                    "Location names must be unique per Location."
-                )
+    partner_ids = fields.Many2many('res.partner.data', string="Agents", compute='_compute_partner_ids')
+    location_name = fields.Char("Display Name", compute='_compute_location_name', store=True)
+    parent_path = fields.Char("Parent Path", compute='_compute_parent_path', store=True)
+    latitude = fields.Float("Latitude", digits=(3, 5), help="Latitude of the centre of the location")
+    longitude = fields.Float("Longitude", digits=(3, 5), help="Longitude of the centre of the location")
+    geo_radius = fields.Float("Radius (km)", help="Agents further than this from the centre fail GEO code validation")
+
+    # Equality exclusion constraints behave as unique indexes on expressions, which
+    # _sql_constraints cannot declare otherwise, and violations keep their message
+    _sql_constraints = [
+        ('name_uniq', 'EXCLUDE USING btree (COALESCE(parent_id, 0) WITH =, lower(name) WITH =)',
+         'Location names must be unique per parent Location.'),
+    ]
+
+    @api.model_cr_context
+    def _auto_init(self):
+        check_exclude_constraints(self._cr, self._table, self._sql_constraints)
+        return super(PartnerLocation, self)._auto_init()
+
+    @api.model_cr
+    def init(self):
+        # parent_path is queried by prefix, which a default btree cannot serve
+        tools.create_index(
+            self._cr, 'res_partner_location_parent_path_index', self._table, ['parent_path text_pattern_ops']
+        )
+        create_trigram_index(self._cr, 'res_partner_location_location_name_trgm_index', self._table, 'location_name')
+        self._rebuild_location_names()
+
+    @api.model
+    def _rebuild_location_names(self):
+        """
+        Rewrites the location_name values that differ from the full path. The ORM
+        does not recompute an existing column when a field becomes a stored compute,
+        so values written by the former name_get are fixed here on every update.
+        Walks parent_id rather than parent_path, which may not be computed yet
+        :return:
+        """
+        self._cr.execute("""
+            WITH RECURSIVE tree(id, location_name) AS (
+                SELECT id, name::varchar FROM res_partner_location WHERE parent_id IS NULL
+                UNION ALL
+                SELECT c.id, (t.location_name || ' / ' || c.name)::varchar
+                FROM res_partner_location c
+                JOIN tree t ON c.parent_id = t.id
             )
+            UPDATE res_partner_location l
+            SET location_name = tree.location_name
+            FROM tree
+            WHERE tree.id = l.id AND l.location_name IS DISTINCT FROM tree.location_name
+        """)
+        self.invalidate_cache(['location_name'])
 
     @api.constrains('parent_id')
     def _check_category_recursion(self):
@@ -93,63 +156,76 @@ class PartnerLocation(models.Model):
             raise ValidationError(_('Error ! You cannot create recursive categories.'))
         return True
 
-    @api.onchange('parent_id', 'name')
-    @api.one
-    def update_display_name(self):
+    @api.depends('name', 'parent_id')
+    def _compute_location_name(self):
         """
-        Update display name on change of parent_id or name
+        Full path of the location e.g Africa / Kenya / Nairobi, recomputed only
+        when the name or parent changes. Descendants are updated by write()
         :return:
         """
-        self.generate_dispaly_name(self)
+        for location in self:
+            if location.parent_id:
+                location.location_name = "%s / %s" % (location.parent_id.location_name, location.name)
+            else:
+                location.location_name = location.name
 
-    def generate_display_name(self, location):
+    @api.multi
+    def _update_descendant_location_names(self):
         """
-        Generates the display name and update to database
+        Rebuilds location_name for the subtrees of self in one UPDATE from the
+        names of the ancestors listed in parent_path
         :return:
         """
-        res = []
-        # Hold inital location
-        tmp_loc = location
-        while location:
-            res.append(location.name)
-            location = location.parent_id
+        if not self.ids:
+            return
+        self._cr.execute("""
+            UPDATE res_partner_location c
+            SET location_name = (
+                SELECT string_agg(a.name, ' / ' ORDER BY p.position)
+                FROM unnest(string_to_array(rtrim(c.parent_path, '/'), '/')::integer[])
+                    WITH ORDINALITY AS p(id, position)
+                JOIN res_partner_location a ON a.id = p.id
+            )
+            WHERE c.parent_path LIKE ANY(
+                SELECT l.parent_path || '%%' FROM res_partner_location l WHERE l.id IN %s
+            )
+        """, (tuple(self.ids),))
+        self.invalidate_cache(['location_name'])
 
-        # Generate display name
-        location_name = " / ".join(reversed(res))
+    @api.multi
+    def write(self, vals):
+        # Moving subtrees moves their agents from the old ancestors' statistics to the new ones'
+        stats = self.env['res.partner.location.stats']
+        before = stats._read_subtree_contributions(self.ids) if 'parent_id' in vals else None
+        res = super(PartnerLocation, self).write(vals)
+        if 'name' in vals or 'parent_id' in vals:
+            self._update_descendant_location_names()
+        if 'parent_id' in vals:
+            stats._queue_deltas(before, stats._read_subtree_contributions(self.ids))
+        return res
 
-        # Generate dispaly name
-        tmp_loc.write({'location_name': location_name})
-        return tmp_loc.location_name
+    @api.multi
+    def unlink(self):
+        # The subtrees are deleted by the parent_id cascade and their agents lose
+        # their location through the foreign key, so all of them leave the ancestors' statistics
+        stats = self.env['res.partner.location.stats']
+        before = stats._read_subtree_contributions(self.ids)
+        res = super(PartnerLocation, self).unlink()
+        stats._queue_deltas(before, {})
+        return res
 
     @api.multi
     def name_get(self):
-        return [(location.id, self.generate_display_name(location)) for location in self]
+        # location_name is the stored full path, read with the other prefetched columns
+        return [(location.id, location.location_name or location.name) for location in self]
 
     @api.model
     def name_search(self, name, args=None, operator='ilike', limit=100):
         if not args:
             args = []
         if name:
-            # Be sure name_search is symetric to name_get
-            location_names = name.split(' / ')
-            parents = list(location_names)
-            child = parents.pop()
-            domain = [('name', operator, child)]
-            if parents:
-                names_ids = self.name_search(' / '.join(parents), args=args, operator='ilike', limit=limit)
-                location_ids = [name_id[0] for name_id in names_ids]
-                if operator in expression.NEGATIVE_TERM_OPERATORS:
-                    locations = self.search([('id', 'not in', location_ids)])
-                    domain = expression.OR([[('parent_id', 'in', location_ids.ids)], domain])
-                else:
-                    domain = expression.AND([[('parent_id', 'in', location_ids)], domain])
-                for i in range(1, len(location_names)):
-                    domain = [[('name', operator, ' / '.join(location_names[-1 - i:]))], domain]
-                    if operator in expression.NEGATIVE_TERM_OPERATORS:
-                        domain = expression.AND(domain)
-                    else:
-                        domain = expression.OR(domain)
-            locations = self.search(expression.AND([domain, args]), limit=limit)
+            # location_name holds the full path, matching name_get, and is trigram indexed
+            locations = self.search(expression.AND([[('location_name', operator, name)], args]), limit=limit)
         else:
             locations = self.search(args, limit=limit)
         return locations.name_get()
@@ -161,11 +237,11 @@ class LocationType(models.Model):
 
     name = fields.Char("Name", required=True)
 
-    @api.constrains("name")
-    def _check_unique_name(self):
-        if self.search([("name", "=", self.name), ("id", "!=", self.id)]):
-            raise UserError(
-                _(
-                    "Location Type names must be unique."
-                )
-            )
+    _sql_constraints = [
+        ('name_uniq', 'EXCLUDE USING btree (lower(name) WITH =)', 'Location Type names must be unique.'),
+    ]
+
+    @api.model_cr_context
+    def _auto_init(self):
+        check_exclude_constraints(self._cr, self._table, self._sql_constraints)
+        return super(LocationType, self)._auto_init()
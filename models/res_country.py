@@ -0,0 +1,98 @@
+import re
+from collections import namedtuple
+
+from odoo import api, fields, models, tools
+
+PhoneRule = namedtuple("PhoneRule", ["phone", "mobile", "example"])
+
+# Used for partners without a country or whose country has no rule configured
+_default_rule = PhoneRule(re.compile(r"^\+\d{3}\d{9}$"), re.compile(r"^\+\d{3}\d{9}$"), "+2547xxxxxxxx")
+
+
+def _compile_phone_rule(phone_code, length, mobile_prefixes):
+    """
+    Compile the phone and mobile patterns of a country
+    :param phone_code: country calling code e.g 254
+    :param length: digits after the calling code e.g 9
+    :param mobile_prefixes: comma separated leading digits of mobile numbers e.g "7,1"
+    :return: PhoneRule
+    """
+    prefixes = [prefix.strip() for prefix in (mobile_prefixes or "").split(",") if prefix.strip()]
+    phone = re.compile(r"^\+%d\d{%d}$" % (phone_code, length))
+    if prefixes:
+        mobile = re.compile(r"^\+%d(?:%s)$" % (phone_code, "|".join(
+            r"%s\d{%d}" % (re.escape(prefix), length - len(prefix)) for prefix in prefixes
+        )))
+    else:
+        mobile = phone
+    lead = prefixes and prefixes[0] or ""
+    example = "+%d%s%s" % (phone_code, lead, "x" * (length - len(lead)))
+    return PhoneRule(phone, mobile, example)
+
+
+class Country(models.Model):
+    _inherit = "res.country"
+
+    phone_number_length = fields.Integer(
+        "Phone Number Length", help="Number of digits after the country calling code e.g 9 for +254712345678"
+    )
+    mobile_prefixes = fields.Char(
+        "Mobile Prefixes", help="Comma separated leading digits of mobile numbers after the calling code e.g 7,1"
+    )
+
+    geo_min_latitude = fields.Float("Minimum Latitude", digits=(3, 5))
+    geo_max_latitude = fields.Float("Maximum Latitude", digits=(3, 5))
+    geo_min_longitude = fields.Float("Minimum Longitude", digits=(3, 5))
+    geo_max_longitude = fields.Float("Maximum Longitude", digits=(3, 5))
+
+    @api.model
+    @tools.ormcache()
+    def _get_phone_rules(self):
+        """
+        Builds the phone rules of every configured country once per registry
+        :return: dict of country id to PhoneRule
+        """
+        self._cr.execute("""
+            SELECT id, phone_code, phone_number_length, mobile_prefixes
+            FROM res_country
+            WHERE phone_code > 0 AND phone_number_length > 0
+        """)
+        return {
+            country_id: _compile_phone_rule(phone_code, length, prefixes)
+            for country_id, phone_code, length, prefixes in self._cr.fetchall()
+        }
+
+    @api.model
+    def _check_phone_numbers(self, numbers):
+        """
+        Validates a batch of numbers against the rules of their countries
+        :param numbers: iterable of (country_id, number, kind) where kind is "phone" or "mobile"
+        :return: list of (number, kind, example) for the invalid numbers
+        """
+        rules = self._get_phone_rules()
+        invalid = []
+        for country_id, number, kind in numbers:
+            rule = rules.get(country_id, _default_rule)
+            pattern = rule.mobile if kind == "mobile" else rule.phone
+            if pattern.match(number) is None:
+                invalid.append((number, kind, rule.example))
+        return invalid
+
+    @api.model
+    def create(self, vals):
+        country = super(Country, self).create(vals)
+        self.clear_caches()
+        return country
+
+    @api.multi
+    def write(self, vals):
+        res = super(Country, self).write(vals)
+        if {"phone_code", "phone_number_length", "mobile_prefixes"}.intersection(vals):
+            self.clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(Country, self).unlink()
+        self.clear_caches()
+        return res
@@ -1,10 +1,15 @@
-import re
 import logging
 import random
+import re
 import datetime
-from odoo import api, fields, models, _
+
+import numpy as np
+from odoo import api, fields, models, tools, _
 from odoo.exceptions import UserError, ValidationError, MissingError
-from odoo.tools.misc import DEFAULT_SERVER_DATETIME_FORMAT
+from odoo.tools.misc import DEFAULT_SERVER_DATETIME_FORMAT, split_every
+
+from .geo import geohash_cover, geohash_encode, haversine, haversine_sql
+from .utils import check_exclude_constraints, create_trigram_index, normalize_phone
 
 _logger = logging.getLogger("Copia Partner")
 
@@ -68,6 +73,19 @@ _child_age = [
     ('anafanya kazi', 'Anafanya kazi'),
 ]
 
+# Agent PINs: 1111-9999 without the default PIN
+_pin_space = [pin for pin in range(1111, 10000) if pin != 1234]
+_pin_random = random.SystemRandom()
+
+# Columns of pin.log written by PartnerData._log_pin_change, besides the audit columns
+_pin_log_columns = ("partner_id", "old_pin", "new_pin")
+
+# Agent statistics kept per location and territory, see stats.py
+_agent_stats_models = ("res.partner.location.stats", "res.partner.territory.stats")
+
+# name_search input made only of digits and phone punctuation is looked up by number
+_phone_search_re = re.compile(r"^\+?[\d\s\-().]+$")
+
 
 class PartnerAgentType(models.Model):
     _name = "agent.type"
@@ -82,27 +100,71 @@ class PartnerAgentType(models.Model):
                                  domain=[('internal_type', '=', 'receivable'),
                                          ('deprecated', '=', False)])
 
-    @api.constrains("name")
-    @api.one
-    def _check_name(self):
-        if self.search_count([("name", "=", self.name), ("id", "!=", self.id)]):
-            raise ValidationError(_(
-                "Name must be unique per Agent Type"
-            ))
+    _sql_constraints = [
+        ("name_uniq", "EXCLUDE USING btree (lower(name) WITH =)", "Name must be unique per Agent Type"),
+    ]
+
+    @api.model_cr_context
+    def _auto_init(self):
+        check_exclude_constraints(self._cr, self._table, self._sql_constraints)
+        return super(PartnerAgentType, self)._auto_init()
+
+    @api.model
+    @tools.ormcache("company_id", "agent_type_id")
+    def _get_receivable_account_id(self, company_id, agent_type_id):
+        """
+        Receivable account for partners of an agent type: the agent type's account,
+        else the company's first receivable account. Cached per company and agent
+        type until an agent type account or a receivable account changes.
+        :return: account.account id or False
+        """
+        account = self.browse(agent_type_id).sudo().account_id
+        if not account:
+            account = self.env["account.account"].sudo().search([
+                ("internal_type", "=", "receivable"), ("deprecated", "=", False), ("company_id", "=", company_id)
+            ], limit=1)
+        return account.id
+
+    @api.model
+    def create(self, vals):
+        agent_type = super(PartnerAgentType, self).create(vals)
+        self.clear_caches()
+        return agent_type
+
+    @api.multi
+    def write(self, vals):
+        res = super(PartnerAgentType, self).write(vals)
+        if "account_id" in vals:
+            self.clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(PartnerAgentType, self).unlink()
+        self.clear_caches()
+        return res
 
 
 class Partner(models.Model):
     _inherit = "res.partner"
 
-    @api.one
+    @api.multi
     def _compute_has_partner_data(self):
-        self.has_partner_data = False
-        if self.partner_data:
-            self.has_partner_data = True
+        # partner_data is prefetched for the whole recordset in one query
+        for partner in self:
+            partner.has_partner_data = bool(partner.partner_data)
 
-    @api.one
+    @api.multi
     def _compute_sms_count(self):
-        self.sms_count = self.env["sms.message"].search([("partner_id", "=", self.id)]).__len__()
+        counts = {}
+        partners = self.filtered("id")
+        if partners:
+            groups = self.env["sms.message"].read_group(
+                [("partner_id", "in", partners.ids)], ["partner_id"], ["partner_id"]
+            )
+            counts = {group["partner_id"][0]: group["partner_id_count"] for group in groups}
+        for partner in self:
+            partner.sms_count = counts.get(partner.id, 0)
 
     is_agent = fields.Boolean(string="Is Agent", help="Whether the partner is an Agent")
     agent_type_id = fields.Many2one("agent.type", string="Agent Type")
@@ -118,6 +180,37 @@ class Partner(models.Model):
     partner_type = fields.Selection(_partner_type, string="Partner Type", store=True, track_visibility="onchange")
     credit_days = fields.Integer('Credit Days')
     agent_id = fields.Many2one('res.partner', "Agent Assigned To", domain=[('is_agent', '=', True)])
+    # Indexed with text_pattern_ops in init, which serves both equality and prefix search
+    phone_e164 = fields.Char("Normalized Phone", compute="_compute_phone_e164", store=True)
+    mobile_e164 = fields.Char("Normalized Mobile", compute="_compute_mobile_e164", store=True)
+
+    @api.model_cr
+    def init(self):
+        super(Partner, self).init()
+        # sms.message is defined by copia_sale, which may not be installed yet
+        if tools.table_exists(self._cr, "sms_message"):
+            tools.create_index(self._cr, "sms_message_partner_id_index", "sms_message", ["partner_id"])
+        tools.create_index(
+            self._cr, "res_partner_phone_e164_pattern_index", self._table, ["phone_e164 text_pattern_ops"]
+        )
+        tools.create_index(
+            self._cr, "res_partner_mobile_e164_pattern_index", self._table, ["mobile_e164 text_pattern_ops"]
+        )
+        create_trigram_index(self._cr, "res_partner_name_trgm_index", self._table, "name")
+        # One partial index per branch of res_partner_personal_agents_rule, so the rule
+        # injected into every salesman query becomes a BitmapOr of two index scans. The
+        # predicates are written as the ORM compiles "= False" and "= True" on booleans,
+        # which the planner needs to prove them from the query's WHERE clause
+        if not tools.index_exists(self._cr, "res_partner_personal_rule_user_index"):
+            self._cr.execute("""
+                CREATE INDEX res_partner_personal_rule_user_index ON res_partner (user_id)
+                WHERE ("supplier" IS NULL or "supplier" = false)
+            """)
+        if not tools.index_exists(self._cr, "res_partner_personal_rule_customer_index"):
+            self._cr.execute("""
+                CREATE INDEX res_partner_personal_rule_customer_index ON res_partner (id)
+                WHERE ("is_agent" IS NULL or "is_agent" = false) AND "customer" = true
+            """)
 
     @api.model
     def create(self, vals):
@@ -125,6 +218,25 @@ class Partner(models.Model):
             vals['active_agent'] = True
         return super(Partner, self).create(vals)
 
+    @api.multi
+    def write(self, vals):
+        if not {"is_agent", "active_agent", "can_purchase", "agent_type_id"}.intersection(vals):
+            return super(Partner, self).write(vals)
+        partner_data = self.mapped("partner_data")
+        before = partner_data._read_agent_stats()
+        res = super(Partner, self).write(vals)
+        partner_data._queue_agent_stats(before)
+        return res
+
+    @api.multi
+    def unlink(self):
+        # Partner data is deleted by the partner_id cascade, without PartnerData.unlink
+        partner_data = self.mapped("partner_data")
+        before = partner_data._read_agent_stats()
+        res = super(Partner, self).unlink()
+        partner_data._queue_agent_stats(before)
+        return res
+
     @api.onchange("partner_type")
     def onchange_partner_type(self):
         self.is_agent = (self.partner_type == "agent")
@@ -139,49 +251,88 @@ class Partner(models.Model):
         assign the defaulf account receivable account
         :return: None
         '''
-        if self.agent_type_id['account_id']:
-            self.property_account_receivable_id = self.agent_type_id['account_id']
-        else:
-            self.property_account_receivable_id = \
-                self.env['account.account'].search([('internal_type', '=', 'receivable'),
-                                                    ('deprecated', '=', False)])[0]['id']
-
-    @api.one
-    @api.constrains("phone")
-    def _check_phone(self):
-        if self.phone:
-            # TODO - replace the first \d{3} with res_partner.country_id.phone_code
-            if re.match(r"^\+\d{3}\d{9}$", self.phone) is None:
-                raise ValidationError("Phone Number MUST be in the format +2547xxxxxxxx, Not (%s)" % self.phone)
-
-            if self.phone == self.mobile:
-                raise ValidationError("Phone Number (%s) cannot be the same as mobile number." % self.phone)
+        company = self.company_id or self.env.user.company_id
+        self.property_account_receivable_id = self.env['agent.type']._get_receivable_account_id(
+            company.id, self.agent_type_id.id
+        )
 
-            if self.search_count([("phone", "=", self.phone)]) > 1:
-                raise ValidationError("Phone Number (%s) must be unique per Partner." % self.phone)
+    @api.multi
+    def action_apply_agent_type(self):
+        """
+        Sets the receivable account of their agent type on all partners, with one
+        property write per company. Like the ORM's inverse of company dependent
+        fields, the properties are written as superuser once access to the partners
+        is checked
+        """
+        self.check_access_rights("write")
+        self.check_access_rule("write")
+        agent_type, accounts = self.env["agent.type"], {}
+        for partner in self:
+            company = partner.company_id or self.env.user.company_id
+            account_id = agent_type._get_receivable_account_id(company.id, partner.agent_type_id.id)
+            if account_id:
+                accounts.setdefault(company.id, {})[partner.id] = account_id
+
+        for company_id, values in accounts.items():
+            self.env["ir.property"].sudo().with_context(force_company=company_id).set_multi(
+                "property_account_receivable_id", self._name, values
+            )
+        self.invalidate_cache(["property_account_receivable_id"])
 
-            elif self.search_count([("mobile", "=", self.phone)]) > 1:
-                raise ValidationError("Mobile Number (%s) must be unique per Partner." % self.phone)
+    @api.depends("phone")
+    def _compute_phone_e164(self):
+        for partner in self:
+            partner.phone_e164 = normalize_phone(partner.phone)
 
-        else:
-            pass
+    @api.depends("mobile")
+    def _compute_mobile_e164(self):
+        for partner in self:
+            partner.mobile_e164 = normalize_phone(partner.mobile)
 
-    @api.one
-    @api.constrains("mobile")
-    def _check_mobile(self):
-        if self.mobile:
-            # TODO - replace the first \d{3} with res_partner.country_id.phone_code
-            if re.match(r"^\+\d{3}\d{9}$", self.mobile) is None:
-                raise ValidationError("Mobile Number MUST be in the format +2547xxxxxxxx, Not (%s)" % self.mobile)
-            if self.phone == self.mobile:
-                raise ValidationError("Mobile Number (%s) cannot be the same as phone number." % self.phone)
-
-            elif self.search_count([("mobile", "=", self.mobile)]) > 1:
-                raise ValidationError("Mobile Number (%s) must be unique per Partner." % self.mobile)
-            elif self.search_count([("phone", "=", self.mobile)]) > 1:
-                raise ValidationError("Phone Number (%s) must be unique per Partner." % self.phone)
-        else:
-            pass
+    @api.constrains("phone", "mobile")
+    def _check_phone(self):
+        """
+        Validates phone and mobile numbers and checks that no two partners share
+        a number, in either field, with one query for the whole batch
+        """
+        labels = {"phone": "Phone", "mobile": "Mobile"}
+        invalid = self.env["res.country"]._check_phone_numbers([
+            (partner.country_id.id, partner[field], field)
+            for partner in self for field in ("phone", "mobile") if partner[field]
+        ])
+        if invalid:
+            number, kind, example = invalid[0]
+            raise ValidationError("%s Number MUST be in the format %s, Not (%s)" % (labels[kind], example, number))
+
+        numbers = {}
+        for partner in self:
+            if partner.phone and partner.phone == partner.mobile:
+                raise ValidationError("Phone Number (%s) cannot be the same as mobile number." % partner.phone)
+
+            for field in ("phone", "mobile"):
+                normalized = normalize_phone(partner[field])
+                if not normalized:
+                    continue
+                # Duplicates within the batch being written
+                if normalized in numbers:
+                    raise ValidationError("%s Number (%s) must be unique per Partner." % (
+                        labels[field], partner[field]))
+                numbers[normalized] = labels[field]
+
+        if not numbers:
+            return
+
+        # Duplicates against the rest of the table, served by the phone_e164/mobile_e164 indexes
+        self._cr.execute("""
+            SELECT phone_e164, mobile_e164
+            FROM res_partner
+            WHERE (phone_e164 IN %s OR mobile_e164 IN %s) AND id NOT IN %s AND active
+            LIMIT 1
+        """, (tuple(numbers), tuple(numbers), tuple(self.ids)))
+        row = self._cr.fetchone()
+        if row:
+            number = row[0] if row[0] in numbers else row[1]
+            raise ValidationError("%s Number (%s) must be unique per Partner." % (numbers[number], number))
 
     @api.multi
     def get_partner_data(self):
@@ -217,13 +368,14 @@ class Partner(models.Model):
 
     @api.multi
     def action_view_sms(self):
-        sms_ids = self.env["sms.message"].search([("partner_id", "=", self.id)]).ids
+        self.ensure_one()
+        domain = [("partner_id", "=", self.id)]
         action = self.env.ref("copia_sale.action_sms_message_all").read()[0]
-        if len(sms_ids) > 1:
-            action["domain"] = [("id", "in", sms_ids)]
-        elif len(sms_ids) == 1:
+        if self.sms_count > 1:
+            action["domain"] = domain
+        elif self.sms_count == 1:
             action["views"] = [(self.env.ref("copia_sale.view_sms_message_form").id, "form")]
-            action["res_id"] = sms_ids[0]
+            action["res_id"] = self.env["sms.message"].search(domain, limit=1).id
         else:
             action = {"type": "ir.actions.act_window_close"}
         return action
@@ -236,6 +388,8 @@ class Partner(models.Model):
         if operator not in ("ilike", "like", "=", "=like", "=ilike"):
             return super(Partner, self).name_search(name, args, operator, limit)
 
+        if name and operator in ("ilike", "="):
+            return self.browse(self._search_ranked(name, args, operator, limit)).name_get()
         if name:
             search_domain = ["|"] + [["phone", operator, name]] + [["name", operator, name]] + args
             result = self.search(search_domain, limit=limit)
@@ -244,19 +398,148 @@ class Partner(models.Model):
 
         return result.name_get()
 
+    @api.model
+    def _get_phone_search_prefixes(self, name):
+        """
+        Normalized forms of a phone-shaped name_search input, matched as prefixes
+        of phone_e164 and mobile_e164. Local numbers are also tried with the
+        calling code of the user's company country e.g "0712" gives "0712" and
+        "+254712", and bare international numbers with a "+" e.g "254712".
+        :return: list of prefixes, empty if name is not phone-shaped
+        """
+        if not _phone_search_re.match(name):
+            return []
+        number = normalize_phone(name)
+        if not number or len(number.lstrip("+")) < 3:
+            return []
+        prefixes = [number]
+        if not number.startswith("+"):
+            prefixes.append("+" + number)
+            phone_code = self.env.user.company_id.country_id.phone_code
+            if number.startswith("0") and phone_code:
+                prefixes.append("+%s%s" % (phone_code, number[1:]))
+        return prefixes
+
+    @api.model
+    def _search_ranked(self, name, args, operator, limit):
+        """
+        Searches partners by phone or name, ranked by match quality, in one query
+        honouring args, active_test and the record rules.
+
+        Names are matched exactly ("=") or by substring ("ilike"), exact matches
+        first, then names starting with the input, then by how early and in how
+        short a name it occurs. Phone-shaped input is also matched exactly or by
+        prefix on the normalized numbers, and those matches come first, exact ones
+        ahead, so that e.g "2019" still finds the partners named after it.
+        :return: list of ids
+        """
+        self.check_access_rights("read")
+        query = self._where_calc(args)
+        self._apply_ir_rules(query, "read")
+        from_clause, where_clause, where_params = query.get_sql()
+        where_str = where_clause and " WHERE %s AND " % where_clause or " WHERE "
+
+        if operator == "=":
+            condition, params = "res_partner.name = %s", [name]
+            rank, rank_params = [], []
+        else:
+            condition, params = "res_partner.name ILIKE %s", ["%%%s%%" % name]
+            rank = ["""CASE WHEN lower(res_partner.name) = lower(%s) THEN 0
+                            WHEN res_partner.name ILIKE %s THEN 1
+                            ELSE 2 END""",
+                    "position(lower(%s) IN lower(res_partner.name))", "length(res_partner.name)"]
+            rank_params = [name, "%s%%" % name, name]
+
+        prefixes = self._get_phone_search_prefixes(name)
+        if prefixes:
+            numbers = tuple(prefixes)
+            if operator == "=":
+                phone_condition = "res_partner.phone_e164 IN %s OR res_partner.mobile_e164 IN %s"
+                phone_params = [numbers, numbers]
+            else:
+                phone_condition = " OR ".join(
+                    ["res_partner.phone_e164 LIKE %s OR res_partner.mobile_e164 LIKE %s"] * len(prefixes)
+                )
+                phone_params = [prefix + "%" for prefix in prefixes for _column in range(2)]
+            condition = "(%s OR %s)" % (phone_condition, condition)
+            params = phone_params + params
+            rank = ["""CASE WHEN res_partner.phone_e164 IN %%s OR res_partner.mobile_e164 IN %%s THEN 0
+                            WHEN %s THEN 1
+                            ELSE 2 END""" % phone_condition] + rank
+            rank_params = [numbers, numbers] + phone_params + rank_params
+
+        self._cr.execute(
+            "SELECT res_partner.id FROM {from_clause}{where}{condition} ORDER BY {rank} {limit}".format(
+                from_clause=from_clause, where=where_str, condition=condition,
+                rank=", ".join(rank + ["res_partner.id"]),
+                limit=limit and "LIMIT %s" or ""
+            ), where_params + params + rank_params + (limit and [limit] or [])
+        )
+        return [row[0] for row in self._cr.fetchall()]
+
+    @api.multi
+    def get_visit_order(self, start=None, time_budget=2.0):
+        """
+        Visit route through the agents of a sales associate
+        :return: see res.partner.route.get_visit_order
+        """
+        self.ensure_one()
+        agents = self.env["res.partner.data"].search([("partner_id.sale_associate_id", "=", self.id)])
+        return self.env["res.partner.route"].get_visit_order(agents.ids, start=start, time_budget=time_budget)
+
     @api.multi
     def action_toggle_active_agent(self):
-        if self.active_agent:
-            self.active_agent = False
-            self.can_purchase = False
-        else:
-            self.active_agent = True
-            self.can_purchase = True
+        activate = self.filtered(lambda partner: not partner.active_agent)
+        activate.set_active_agent(True)
+        (self - activate).set_active_agent(False)
+
+    @api.multi
+    def set_active_agent(self, active=True):
+        """
+        Activates or deactivates agents with a single write, and so a single
+        tracking pass, for the whole recordset. can_earn_commission of their
+        partner data is recomputed by the ORM
+        :param active: True to activate, False to deactivate
+        """
+        partners = self.filtered(lambda partner: partner.active_agent != active or partner.can_purchase != active)
+        if partners:
+            partners.write({"active_agent": active, "can_purchase": active})
+        return True
+
+    @api.model
+    def set_active_agent_domain(self, domain, active=True):
+        """
+        set_active_agent for the partners matching a domain e.g over XML-RPC
+        """
+        return self.search(domain).set_active_agent(active)
+
+    @api.model
+    def _create_sms_messages(self, messages, chunk_size=0):
+        """
+        Creates sms.message records in chunks. When chunk_size is set the transaction
+        is committed after every chunk, so a failure part way through does not roll
+        back the messages already queued.
+
+        :param messages: list of (add_to_queue, vals)
+        :param chunk_size: messages per committed chunk, 0 to create all without committing
+        :return: number of messages created
+        """
+        sms, senders, count = self.env["sms.message"], {}, 0
+        for chunk in split_every(chunk_size or len(messages) or 1, messages):
+            for add_to_queue, vals in chunk:
+                if add_to_queue not in senders:
+                    senders[add_to_queue] = sms.with_context(add_to_queue=add_to_queue)
+                senders[add_to_queue].create(vals)
+            count += len(chunk)
+            if chunk_size:
+                self._cr.commit()
+                _logger.info("Created %s/%s SMS messages", count, len(messages))
+        return count
 
     @api.multi
     def action_sms_new_agent(self):
         # FIXME: Move hard-coded SMS messages to ERP
-        res, sms = list([]), self.env["sms.message"]
+        res = list([])
 
         if not self._context.get("date_from", False) and not self._context.get("date_to", False):
             _now = fields.datetime.now()
@@ -274,84 +557,114 @@ class Partner(models.Model):
                        "Mwakilishi wako wa Copia atakutembelea hivi karibuni kukusaidia kuagiza."
         )
 
-        for partner in self.search([
+        # One query for the eligible agents and their display names
+        partners = self.search_read([
             ("create_date", ">=", from_time.__str__()), ("create_date", "<=", to_time.__str__()),
             ("partner_type", "=", "agent")
-        ]):
-            if not partner.phone or partner.phone is None or partner.phone.__len__() == 0:
+        ], ["display_name", "phone"])
+
+        messages, date = list([]), datetime.datetime.today().isoformat()
+        for partner in partners:
+            if not partner["phone"]:
                 _queue = False
             else:
                 _queue = self._context.get("add_to_queue", True)
 
-            sms.with_context(add_to_queue=_queue).create({
-                "partner_id": partner.id,
+            messages.append((_queue, {
+                "partner_id": partner["id"],
                 "type": "outbox",
                 "from_num": "Copia",
-                "to_num": partner.phone,
-                "date": datetime.datetime.today().isoformat(),
+                "to_num": partner["phone"],
+                "date": date,
                 "text": msg,
                 "note": _queue and "Copia New Agent" or "Copia New Agent Failure (No Number)"
-            })
+            }))
             res.append({
-                "partner": partner.name_get(),
-                "phone": partner.phone,
+                "partner": [(partner["id"], partner["display_name"])],
+                "phone": partner["phone"],
                 "message": msg,
                 "queued": _queue
             })
 
+        self._create_sms_messages(messages, self._context.get("chunk_size", 0))
         return res
 
+    @api.model
+    def _get_night_to_pay_query(self, date_invoice):
+        """
+        Partners owing on the invoice date with their invoiced amount. The WHERE
+        clause matches the predicate of account_invoice_night_to_pay_index
+        :return: (query, params) selecting (partner id, phone, amount total)
+        """
+        return """
+            SELECT
+                r.id,
+                r.phone,
+                -- SUM(i.residual) residual,
+                SUM(i.amount_total) amount_total
+            FROM account_invoice i
+            JOIN res_partner r ON r.id = i.partner_id
+            WHERE i.date_invoice = %s
+            AND i.state != 'cancel' AND i.type = 'out_invoice'
+            GROUP BY r.id HAVING SUM(i.residual) > 0
+        """, (date_invoice,)
+
     @api.multi
     def action_sms_night_to_pay(self):
+        """
+        Queues the Night-to-Pay SMS for every partner owing on the invoice date.
+        Rows are streamed from a server-side cursor and messages created batch by
+        batch, so memory stays flat however many partners owe money.
+
+        :return: summary dict with the partners, queued and failed message counts and the amount total
+        """
         # FIXME: Move hard-coded SMS messages to ERP
-        res = list([])
         msg = self._context.get(
             "message", "Asante kwa kuagiza bidhaa na Copia. Bidhaa zitakazoletwa leo ni ya thamani ya "
                        "KSHS {:0,.2f}. Tafadhali lipa kwa njia ya MPESA kabla ya madereva wetu kuwasili."
         )
 
         date_invoice = self._context.get("date_invoice", fields.date.today())
-
-        self._cr.execute("""
-        SELECT
-            r.id,
-            r.name,
-            r.phone,
-            -- SUM(i.residual) residual,
-            SUM(i.amount_total) amount_total
-        FROM account_invoice i
-        JOIN res_partner r ON r.id = i.partner_id
-        WHERE i.date_invoice = %s
-        AND i.state != 'cancel' AND i.type = 'out_invoice'
-        GROUP BY r.id HAVING SUM(i.residual) > 0;
-       """, (date_invoice,))
-
-        sms = self.env["sms.message"]
-        for inv in self._cr.dictfetchall():
-            if not inv.get("phone", False) or inv.get("phone", "").__len__() == 0:
-                _queue = False
-            else:
-                _queue = self._context.get("add_to_queue", True)
-
-            sms.with_context(add_to_queue=_queue).create({
-                "partner_id": inv.get("id"),
-                "type": "outbox",
-                "from_num": "Copia",
-                "to_num": inv.get("phone"),
-                "date": datetime.datetime.today().isoformat(),
-                # "text": msg.format(inv.get("residual", 0)),
-                "text": msg.format(inv.get("amount_total", 0)),
-                "note": _queue and "Copia SMS Night-to-Pay" or "Copia SMS Night-to-Pay Failure (No Number)"
-            })
-            res.append({
-                "partner": inv.get("name"),
-                "phone": inv.get("phone"),
-                # "message": msg.format(inv.get("residual", 0)),
-                "message": msg.format(inv.get("amount_total", 0)),
-                "queued": _queue
-            })
-
-        return res
+        chunk_size = self._context.get("chunk_size", 0)
+        summary = {"partners": 0, "queued": 0, "failed": 0, "amount_total": 0.0}
+
+        # Held across commits when chunk_size makes _create_sms_messages commit
+        cursor = self._cr._cnx.cursor("copia_sms_night_to_pay", withhold=bool(chunk_size))
+        try:
+            cursor.execute(*self._get_night_to_pay_query(date_invoice))
+
+            date = datetime.datetime.today().isoformat()
+            while True:
+                rows = cursor.fetchmany(chunk_size or 1000)
+                if not rows:
+                    break
+
+                messages = list([])
+                for partner_id, phone, amount_total in rows:
+                    if not phone:
+                        _queue = False
+                    else:
+                        _queue = self._context.get("add_to_queue", True)
+
+                    messages.append((_queue, {
+                        "partner_id": partner_id,
+                        "type": "outbox",
+                        "from_num": "Copia",
+                        "to_num": phone,
+                        "date": date,
+                        # "text": msg.format(residual or 0),
+                        "text": msg.format(amount_total or 0),
+                        "note": _queue and "Copia SMS Night-to-Pay" or "Copia SMS Night-to-Pay Failure (No Number)"
+                    }))
+                    summary["partners"] += 1
+                    summary["queued" if _queue else "failed"] += 1
+                    summary["amount_total"] += amount_total or 0
+
+                self._create_sms_messages(messages, chunk_size)
+        finally:
+            cursor.close()
+
+        return summary
 
     def _track_subtype(self, init_values):
         """
@@ -379,16 +692,13 @@ class PartnerData(models.Model):
     _name = "res.partner.data"
     _description = "Partner Extra Data"
 
-    @api.one
+    @api.multi
     def _compute_agent_type(self):
-        for partner in self:
-            partner.agent_type_id = self.partner_id.agent_type_id
-            partner.agent_type_name = self.partner_id.agent_type_id['name']
-
-    @api.one
-    def _compute_no_children(self):
-        for partner in self:
-            partner.no_of_children = len(self.customer_children)
+        # Reading through each record keeps the prefetch: partners, agent types and
+        # their names are loaded with one query each for the whole recordset
+        for data in self:
+            data.agent_type_id = data.partner_id.agent_type_id
+            data.agent_type_name = data.partner_id.agent_type_id.name
 
     # Sales & Basic
     name = fields.Char(default="New")
@@ -454,8 +764,8 @@ class PartnerData(models.Model):
     # Location
     latitude = fields.Float("Latitude", digits=(3, 5))
     longitude = fields.Float("Longitude", digits=(3, 5))
-    location_id = fields.Many2one("res.partner.location", "Location")
-    territory_id = fields.Many2one("res.partner.territory", "Territory")
+    location_id = fields.Many2one("res.partner.location", "Location", index=True)
+    territory_id = fields.Many2one("res.partner.territory", "Territory", index=True)
     location_type_id = fields.Many2one("res.partner.location.type", string="Location Type")
     directions = fields.Text()
 
@@ -471,6 +781,229 @@ class PartnerData(models.Model):
     agent_type_name = fields.Char("Agent Type", store=False, compute='_compute_agent_type')
     no_of_children = fields.Selection(_no_of_children, string="No. of children", store=True)
     geo_code_valid = fields.Boolean("Validated GEO coded")
+    geohash = fields.Char("Geohash", compute="_compute_geohash", store=True)
+    geo_within = fields.Boolean(
+        "Within Distance", compute="_compute_geo_within", search="_search_geo_within",
+        help="Search only: ('geo_within', '=', [latitude, longitude, radius_km])"
+    )
+    # Search only, what ('location_id' or 'territory_id', 'child_of', ids) is rewritten to
+    location_subtree = fields.Boolean(
+        "Within Locations", compute="_compute_subtree", search="_search_location_subtree",
+        help="Search only: ('location_subtree', 'in', location ids)"
+    )
+    territory_subtree = fields.Boolean(
+        "Within Territories", compute="_compute_subtree", search="_search_territory_subtree",
+        help="Search only: ('territory_subtree', 'in', territory ids)"
+    )
+
+    @api.model_cr
+    def init(self):
+        # geohash is queried by prefix, which a default btree cannot serve
+        tools.create_index(self._cr, "res_partner_data_geohash_index", self._table, ["geohash text_pattern_ops"])
+
+    @api.depends("latitude", "longitude")
+    def _compute_geohash(self):
+        for data in self:
+            if data.latitude and data.longitude:
+                data.geohash = geohash_encode(data.latitude, data.longitude)
+            else:
+                data.geohash = False
+
+    @api.multi
+    def _compute_geo_within(self):
+        for data in self:
+            data.geo_within = False
+
+    @api.model
+    def _search_geo_within(self, operator, value):
+        latitude, longitude, radius_km = value
+        query, params = self._get_geo_query(latitude, longitude, radius_km)
+        return [("id", "not inselect" if operator == "!=" else "inselect", (
+            "SELECT id FROM (%s) AS nearby" % query, params
+        ))]
+
+    @api.multi
+    def _compute_subtree(self):
+        for data in self:
+            data.location_subtree = data.territory_subtree = False
+
+    @api.model
+    def _search_subtree(self, field_name, operator, value):
+        """
+        Leaf matching the records whose ``field_name`` is in the subtrees of the ids
+        in value, as a single subquery. Leaves returned by a search method are
+        parsed as internal, which is what allows inselect here
+        """
+        ids = [value] if isinstance(value, int) else value
+        comodel = self.env[self._fields[field_name].comodel_name]
+        operator = "not inselect" if operator in ("not in", "!=") else "inselect"
+        return [(field_name, operator, comodel._get_subtree_query(ids))]
+
+    @api.model
+    def _search_location_subtree(self, operator, value):
+        return self._search_subtree("location_id", operator, value)
+
+    @api.model
+    def _search_territory_subtree(self, operator, value):
+        return self._search_subtree("territory_id", operator, value)
+
+    @api.model
+    def _where_calc(self, domain, active_test=True):
+        return super(PartnerData, self)._where_calc(self._expand_child_of(domain), active_test)
+
+    @api.model
+    def _expand_child_of(self, domain):
+        """
+        Rewrites ('location_id' or 'territory_id', 'child_of', ids) leaves to the
+        location_subtree and territory_subtree search fields, which select the
+        subtrees with one subquery over the stored parent_path instead of expanding
+        the tree level by level. This covers search, read_group and record rules.
+        :return: the domain
+        """
+        result = []
+        for leaf in domain or []:
+            if isinstance(leaf, (list, tuple)) and len(leaf) == 3 and leaf[1] == "child_of" \
+                    and leaf[0] in ("location_id", "territory_id"):
+                ids = [leaf[2]] if isinstance(leaf[2], int) else leaf[2]
+                if isinstance(ids, (list, tuple)) and all(isinstance(i, int) for i in ids):
+                    leaf = (leaf[0].replace("_id", "_subtree"), "in", list(ids))
+            result.append(leaf)
+        return result
+
+    @api.model
+    def _get_geo_query(self, latitude, longitude, radius_km):
+        """
+        SQL selecting the (id, distance in km) of the agents within radius_km of
+        the point. Candidates are narrowed with geohash prefixes, which use the
+        geohash index, before the exact distance is checked.
+        :return: (query, params)
+        """
+        params = [latitude, latitude, longitude]
+        where = "latitude IS NOT NULL AND longitude IS NOT NULL"
+        prefixes = geohash_cover(latitude, longitude, radius_km)
+        if prefixes:
+            where += " AND (%s)" % " OR ".join(["geohash LIKE %s"] * len(prefixes))
+            params += [prefix + "%" for prefix in prefixes]
+        query = """
+            SELECT id, distance FROM (
+                SELECT id, {distance} AS distance FROM res_partner_data WHERE {where}
+            ) AS candidates
+            WHERE distance <= %s
+        """.format(distance=haversine_sql("latitude", "longitude"), where=where)
+        return query, params + [radius_km]
+
+    @api.model
+    def get_agents_within(self, latitude, longitude, radius_km, limit=None):
+        """
+        Agents within radius_km of the point, nearest first
+        :return: list of (res.partner.data id, distance in km)
+        """
+        query, params = self._get_geo_query(latitude, longitude, radius_km)
+        query += " ORDER BY distance"
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+        self._cr.execute(query, params)
+        return self._cr.fetchall()
+
+    @api.model
+    def get_nearest_agents(self, latitude, longitude, limit=10, max_radius_km=500.0):
+        """
+        The limit agents nearest to the point. The search radius grows until enough
+        agents are found, which gives the exact nearest since results are sorted.
+        :return: list of (res.partner.data id, distance in km)
+        """
+        radius_km = min(1.0, max_radius_km)
+        while True:
+            agents = self.get_agents_within(latitude, longitude, radius_km, limit=limit)
+            if len(agents) >= limit or radius_km >= max_radius_km:
+                return agents
+            radius_km = min(radius_km * 4, max_radius_km)
+
+    @api.model
+    def _validate_geo_codes(self, batch_size=50000):
+        """
+        Validates the coordinates of every agent and writes geo_code_valid back in
+        bulk. Coordinates are streamed from a server-side cursor into NumPy arrays
+        and flagged invalid when they are missing or out of range, outside the
+        bounding box of the partner's country, further than the radius of the
+        location's centre or shared with another agent. Private as it bypasses the
+        ORM and access rights, it is run by the ir_cron_validate_geo_codes cron.
+
+        :param batch_size: rows fetched per round trip
+        :return: summary dict with the number of agents checked and flagged per reason
+        """
+        cursor = self._cr._cnx.cursor("copia_validate_geo_codes")
+        try:
+            cursor.execute("""
+                SELECT d.id, d.latitude, d.longitude,
+                    c.geo_min_latitude, c.geo_max_latitude, c.geo_min_longitude, c.geo_max_longitude,
+                    l.latitude, l.longitude, l.geo_radius
+                FROM res_partner_data d
+                JOIN res_partner p ON p.id = d.partner_id
+                LEFT JOIN res_country c ON c.id = p.country_id
+                LEFT JOIN res_partner_location l ON l.id = d.location_id
+            """)
+            batches = []
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                # NULLs become NaN
+                batches.append(np.array(rows, dtype=float))
+        finally:
+            cursor.close()
+
+        if not batches:
+            return {"checked": 0, "valid": 0, "out_of_range": 0, "out_of_country": 0,
+                    "out_of_location": 0, "duplicate": 0}
+
+        data = np.concatenate(batches)
+        ids = data[:, 0].astype(np.int64)
+        lat, lon = data[:, 1], data[:, 2]
+        min_lat, max_lat, min_lon, max_lon = data[:, 3], data[:, 4], data[:, 5], data[:, 6]
+        centre_lat, centre_lon, radius = data[:, 7], data[:, 8], data[:, 9]
+
+        with np.errstate(invalid="ignore"):
+            in_range = (np.isfinite(lat) & np.isfinite(lon) & (lat != 0) & (lon != 0) &
+                        (np.abs(lat) <= 90) & (np.abs(lon) <= 180))
+
+            # Countries without a bounding box (NaN or all zeros) are not checked
+            has_box = np.isfinite(min_lat) & np.isfinite(max_lat) & (min_lat < max_lat)
+            in_country = ~has_box | ((lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon))
+
+            has_centre = np.isfinite(centre_lat) & np.isfinite(centre_lon) & (radius > 0)
+            in_location = ~has_centre | (haversine(lat, lon, centre_lat, centre_lon) <= radius)
+
+        # Coordinates are stored with 5 decimals; pack both into one integer key
+        keys = (np.round(lat[in_range] * 1e5).astype(np.int64) * 40000000 +
+                np.round(lon[in_range] * 1e5).astype(np.int64))
+        __, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        unique = np.ones(ids.size, dtype=bool)
+        unique[in_range] = counts[inverse] == 1
+
+        valid = in_range & in_country & in_location & unique
+
+        self._cr.execute("""
+            UPDATE res_partner_data SET geo_code_valid = true
+            WHERE id = ANY(%s) AND geo_code_valid IS NOT TRUE
+        """, (ids[valid].tolist(),))
+        self._cr.execute("""
+            UPDATE res_partner_data SET geo_code_valid = false
+            WHERE id = ANY(%s) AND geo_code_valid IS NOT FALSE
+        """, (ids[~valid].tolist(),))
+        self.invalidate_cache(["geo_code_valid"])
+
+        summary = {
+            "checked": int(ids.size),
+            "valid": int(valid.sum()),
+            "out_of_range": int((~in_range).sum()),
+            "out_of_country": int((in_range & ~in_country).sum()),
+            "out_of_location": int((in_range & ~in_location).sum()),
+            "duplicate": int((~unique).sum()),
+        }
+        _logger.info("Validated GEO codes: %s", summary)
+        return summary
 
     @api.one
     @api.constrains("latitude", "longitude")
@@ -482,49 +1015,87 @@ class PartnerData(models.Model):
 
     @api.model
     def create(self, vals):
-        if vals.get("name", "New") == "New":
-            p = self.env["res.partner"].browse(self.env.context.get("active_id", False))
-            vals.update({
-                "name": p and p.name or "New"
-            })
+        return self.create_batch([vals])
 
-        '''
-        Assign agents a random 4-digit PIN and send message with the PIN
-        '''
-        pin = 0000
-        partner = False
-        if self.env.context.get('default_partner_id'):
-            partner = self.env['res.partner'].browse(self.env.context.get('default_partner_id'))
-            if partner and partner.is_agent:
-                while True:
-                    r = random.randint(1111, 9999)
-                    if r not in [1234, 0000]:
-                        pin = "%04d" % r
-                        vals.update({"pin": pin})
-                        break
-
-        partner_data_id = super(PartnerData, self).create(vals)
-        if partner_data_id.id and partner:
-            if partner.phone and partner.is_agent:
-                msg = "Your Copia PIN is %s . PIN yako, SIRI yako." % pin
-                # _logger.info('%s--%s' % (partner.phone, msg))
-                self.env["sms.message"].with_context(add_to_queue=True).create({
-                    "type": "outbox",
-                    "from_num": "Copia",
-                    "to_num": partner.phone,
-                    "date": datetime.datetime.today().isoformat(),
-                    "text": msg,
-                    "note": "Copia PIN generation"
-                })
-        return partner_data_id
+    @api.model
+    def _allocate_pins(self, count):
+        """
+        Draws random 4-digit PINs from the operating system's CSPRNG, distinct
+        within the batch for as long as the PIN space allows
+        :param count: number of PINs
+        :return: list of PINs e.g ["4821", ...]
+        """
+        pins = []
+        while len(pins) < count:
+            pins.extend(_pin_random.sample(_pin_space, min(count - len(pins), len(_pin_space))))
+        return ["%04d" % pin for pin in pins]
+
+    @api.model
+    @api.returns('self', lambda records: records.ids)
+    def create_batch(self, vals_list):
+        """
+        Creates partner data in bulk e.g for agents onboarded from a CSV. Partners
+        are resolved with one read, agents are assigned a random 4-digit PIN from
+        a single allocation and their PIN SMSes are queued together
+
+        :param vals_list: list of vals as for create()
+        :return: the created records
+        """
+        context_partner_id = self.env.context.get("default_partner_id")
+        # Default names come from each row's own partner, the context's active
+        # partner is only a fallback for rows without one
+        active_id = self.env.context.get("active_model") == "res.partner" and self.env.context.get("active_id")
+        partner_ids = {vals.get("partner_id") or context_partner_id for vals in vals_list}
+        if active_id and any(not vals.get("partner_id") and vals.get("name", "New") == "New" for vals in vals_list):
+            partner_ids.add(active_id)
+        partners = {
+            partner["id"]: partner for partner in
+            self.env["res.partner"].browse([i for i in partner_ids if i]).read(["name", "is_agent", "phone"])
+        }
+
+        def get_agent(vals):
+            partner = partners.get(vals.get("partner_id") or context_partner_id)
+            return partner if partner and partner["is_agent"] else None
+
+        pins = iter(self._allocate_pins(len([vals for vals in vals_list if get_agent(vals)])))
+
+        record_ids, messages, date = [], [], datetime.datetime.today().isoformat()
+        for vals in vals_list:
+            vals = dict(vals)
+            if vals.get("name", "New") == "New":
+                vals["name"] = partners.get(vals.get("partner_id") or active_id, {}).get("name") or "New"
+
+            # Assign agents a random 4-digit PIN and send message with the PIN
+            agent = get_agent(vals)
+            if agent:
+                vals["pin"] = next(pins)
+                if agent["phone"]:
+                    messages.append((True, {
+                        "type": "outbox",
+                        "from_num": "Copia",
+                        "to_num": agent["phone"],
+                        "date": date,
+                        "text": "Your Copia PIN is %s . PIN yako, SIRI yako." % vals["pin"],
+                        "note": "Copia PIN generation"
+                    }))
+
+            record_ids.append(super(PartnerData, self).create(vals).id)
+
+        if messages:
+            self.env["res.partner"]._create_sms_messages(messages)
+        records = self.browse(record_ids)
+        records._queue_agent_stats()
+        return records
 
-    @api.one
     @api.constrains("alternate_contact_phone")
     def _check_phone(self):
-        if self.alternate_contact_phone:
-            if re.match(r"^\+\d{3}\d{9}$", self.alternate_contact_phone) is None:
-                raise ValidationError(
-                    "Phone Number MUST be in the format +2547xxxxxxxx, Not (%s)" % self.alternate_contact_phone)
+        invalid = self.env["res.country"]._check_phone_numbers([
+            (data.partner_id.country_id.id, data.alternate_contact_phone, "phone")
+            for data in self if data.alternate_contact_phone
+        ])
+        if invalid:
+            number, kind, example = invalid[0]
+            raise ValidationError("Phone Number MUST be in the format %s, Not (%s)" % (example, number))
 
     @api.one
     @api.constrains("number_of_permanent_workers", "number_of_casual_works")
@@ -540,12 +1111,58 @@ class PartnerData(models.Model):
             if not self.business_name or not self.business_type:
                 raise ValidationError("Enter Agent Business Name or Agent Business Type")
 
-    @api.one
-    @api.depends("partner_id")
+    @api.multi
+    @api.depends("partner_id", "partner_id.is_agent", "partner_id.active_agent", "partner_id.can_purchase")
     def _compute_can_earn_commission(self):
-        self.can_earn_commission = False
-        if (self.partner_id.is_agent and self.partner_id.active_agent and self.partner_id.can_purchase):
-            self.can_earn_commission = True
+        for data in self:
+            partner = data.partner_id
+            data.can_earn_commission = bool(partner.is_agent and partner.active_agent and partner.can_purchase)
+
+    @api.model
+    def _recompute_can_earn_commission(self, chunk_size=100000, commit=False):
+        """
+        Rebuilds can_earn_commission for the whole table in SQL, one id range of
+        chunk_size rows per UPDATE. Only rows whose value changes are written.
+        Meant for shell use after bulk imports that bypass the ORM e.g.
+
+            env['res.partner.data']._recompute_can_earn_commission(commit=True)
+
+        :param chunk_size: number of ids per UPDATE
+        :param commit: commit after every chunk to keep locks and the transaction short
+        :return: number of rows updated
+        """
+        self._cr.execute("SELECT MIN(id), MAX(id) FROM res_partner_data")
+        min_id, max_id = self._cr.fetchone()
+        if min_id is None:
+            return 0
+
+        updated = 0
+        for start in range(min_id, max_id + 1, chunk_size):
+            self._cr.execute(
+                """
+                UPDATE res_partner_data d
+                   SET can_earn_commission = new.value
+                  FROM (SELECT d.id, COALESCE(p.is_agent AND p.active_agent AND p.can_purchase, false) AS value
+                          FROM res_partner_data d
+                          LEFT JOIN res_partner p ON p.id = d.partner_id
+                         WHERE d.id >= %s AND d.id < %s) new
+                 WHERE d.id = new.id
+                   AND d.can_earn_commission IS DISTINCT FROM new.value
+                """, (start, start + chunk_size)
+            )
+            updated += self._cr.rowcount
+            if commit:
+                self._cr.commit()
+            _logger.info(
+                "Recomputed can_earn_commission up to id %s/%s, %s row(s) updated",
+                min(start + chunk_size - 1, max_id), max_id, updated
+            )
+
+        self.invalidate_cache(["can_earn_commission"])
+        if updated:
+            self.env["res.partner.location.stats"]._rebuild()
+            self.env["res.partner.territory.stats"]._rebuild()
+        return updated
 
     # TODO: Perhaps check res.partner.data.alt_contact_phone
     # @api.one
@@ -560,28 +1177,92 @@ class PartnerData(models.Model):
 
     @api.multi
     def action_toggle_can_earn_commission(self):
-        if self.can_earn_commission:
-            self.can_earn_commission = False
-        else:
-            self.can_earn_commission = True
+        enable = self.filtered(lambda data: not data.can_earn_commission)
+        if enable:
+            enable.write({"can_earn_commission": True})
+        if self - enable:
+            (self - enable).write({"can_earn_commission": False})
+
+    @api.multi
+    def _log_pin_change(self, new_pin):
+        """
+        Logs the PIN change of every record in self to pin.log with a single
+        INSERT ... SELECT, reading the old PINs in the same statement, so that a
+        regional PIN reset is one statement however many agents it covers.
+
+        pin.log is defined by a module installed on top of this one, which it
+        cannot depend on, so the columns written here are checked against the
+        model first: partner_id, old_pin and new_pin plus the audit columns
+        create_uid, create_date, write_uid and write_date. Create access is
+        checked, create overrides of pin.log are not run.
+        :param new_pin: the PIN being written
+        """
+        if not self.ids:
+            return
+        pin_log = self.env["pin.log"]
+        pin_log.check_access_rights("create")
+        missing = set(_pin_log_columns) - set(pin_log._fields)
+        required = [
+            name for name, field in pin_log._fields.items()
+            if field.required and field.store and field.default is None
+            and name not in _pin_log_columns and name not in models.MAGIC_COLUMNS
+        ]
+        if missing or required:
+            raise UserError(_("pin.log does not match the columns PIN changes are logged with: %s") % ", ".join(
+                sorted(missing) + sorted(required)
+            ))
+        self._cr.execute("""
+            INSERT INTO pin_log (partner_id, old_pin, new_pin, create_uid, create_date, write_uid, write_date)
+            SELECT id, pin, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+            FROM res_partner_data
+            WHERE id IN %s
+        """, (new_pin, self._uid, self._uid, tuple(self.ids)))
+        pin_log.invalidate_cache()
 
     @api.multi
     def write(self, vals):
         '''
         Every time the PIN is changed we need to keep a log
         '''
-        _logger.info('In copia_partner partner write. vals are %s', vals)
-        pin_vals = []
+        # Field names only: values include PINs
+        _logger.info("In copia_partner partner write. Writing %s on %s record(s)", list(vals), len(self))
         if 'pin' in vals:
-            browse_ids = self.ids
-            for partner in self.browse(browse_ids):
-                pin_vals.append({'partner_id': partner.id, 'old_pin': partner.pin, 'new_pin': vals['pin']})
-        pin_log_obj = self.env['pin.log']
-        for v in pin_vals:
-            pin_log_obj.create(v)
+            self._log_pin_change(vals['pin'])
+        counted = {'location_id', 'territory_id', 'partner_id', 'can_earn_commission'}.intersection(vals)
+        before = self._read_agent_stats() if counted else None
         res = super(PartnerData, self).write(vals)
+        if counted:
+            self._queue_agent_stats(before)
         return res
 
+    @api.multi
+    def unlink(self):
+        before = self._read_agent_stats()
+        res = super(PartnerData, self).unlink()
+        # The rows are gone, so everything read before is queued as a decrease
+        self._queue_agent_stats(before)
+        return res
+
+    @api.multi
+    def _read_agent_stats(self):
+        """
+        Counts of self in the location and territory statistics, taken before a
+        change and given back to _queue_agent_stats after it
+        :return: dict of stats model to its _read_contributions
+        """
+        return {model: self.env[model]._read_data_contributions(self.ids) for model in _agent_stats_models}
+
+    @api.multi
+    def _queue_agent_stats(self, before=None):
+        """
+        Queues the change of the location and territory statistics since
+        _read_agent_stats returned ``before``, or since self did not exist
+        """
+        before = before or {}
+        for model in _agent_stats_models:
+            stats = self.env[model]
+            stats._queue_deltas(before.get(model, {}), stats._read_data_contributions(self.ids))
+
 
 class PartnerDataChildren(models.Model):
     _name = "res.partner.data.children"
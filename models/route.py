@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+
+from odoo import api, models
+
+from .geo import haversine
+
+
+def _route_distance(matrix, order):
+    return float(matrix[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def _nearest_neighbour(matrix, start=0):
+    """
+    Greedy route: always visit the closest stop not yet visited
+    :return: np.array of stop indexes
+    """
+    visited = np.zeros(len(matrix), dtype=bool)
+    order = [start]
+    visited[start] = True
+    for __ in range(len(matrix) - 1):
+        nearest = int(np.argmin(np.where(visited, np.inf, matrix[order[-1]])))
+        order.append(nearest)
+        visited[nearest] = True
+    return np.array(order)
+
+
+def _two_opt(matrix, order, deadline):
+    """
+    Improves an open route by reversing segments while that shortens it, until
+    no reversal helps or the deadline passes. The first stop stays first.
+    :return: np.array of stop indexes
+    """
+    order, size = order.copy(), len(order)
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        for i in range(1, size - 1):
+            # Reverse order[i:j + 1] for every j > i at once: edges (a, b) and
+            # (c, d) become (a, c) and (b, d), d being absent at the end of the route
+            a, b = order[i - 1], order[i]
+            c = order[i + 1:]
+            d = np.append(order[i + 2:], -1)
+            has_d = d >= 0
+            gains = (matrix[a, b] + np.where(has_d, matrix[c, d], 0) -
+                     matrix[a, c] - np.where(has_d, matrix[b, d], 0))
+            best = int(np.argmax(gains))
+            if gains[best] > 1e-9:
+                order[i:i + best + 2] = order[i:i + best + 2][::-1].copy()
+                improved = True
+            if time.time() >= deadline:
+                break
+    return order
+
+
+class PartnerRoute(models.AbstractModel):
+    _name = "res.partner.route"
+    _description = "Agent Visit Route"
+
+    @api.model
+    def get_visit_order(self, partner_data_ids, start=None, time_budget=2.0):
+        """
+        Orders agents into a short visit route: a haversine distance matrix, a
+        nearest neighbour route and 2-opt improvements within the time budget.
+        Agents without coordinates are left out.
+
+        :param partner_data_ids: res.partner.data ids to visit
+        :param start: optional (latitude, longitude) the route starts from
+        :param time_budget: seconds allowed for the whole computation
+        :return: dict with the ordered res.partner.data "ids" and the "distance" in km
+        """
+        deadline = time.time() + time_budget
+        stops = [
+            (data["id"], data["latitude"], data["longitude"])
+            for data in self.env["res.partner.data"].browse(partner_data_ids).read(["latitude", "longitude"])
+            if data["latitude"] and data["longitude"]
+        ]
+        if start:
+            stops.insert(0, (False, start[0], start[1]))
+        if not stops:
+            return {"ids": [], "distance": 0.0}
+
+        ids = [stop[0] for stop in stops]
+        latitude = np.array([stop[1] for stop in stops])
+        longitude = np.array([stop[2] for stop in stops])
+        matrix = haversine(latitude[:, None], longitude[:, None], latitude[None, :], longitude[None, :])
+
+        order = _two_opt(matrix, _nearest_neighbour(matrix), deadline)
+        return {
+            "ids": [ids[index] for index in order if ids[index]],
+            "distance": _route_distance(matrix, order),
+        }
@@ -0,0 +1,217 @@
+from odoo import api, fields, models
+
+
+class PartnerStatsMixin(models.AbstractModel):
+    """
+    Agent counts per node of a partner hierarchy and agent type, covering the
+    node's whole subtree. Rows are maintained in SQL: writes only queue the
+    change of the agent counts per node path in res.partner.stats.delta, which
+    a cron folds into the rows every few minutes, so concurrent agent writes
+    never update the same statistics rows. The whole table is rebuilt nightly.
+    """
+    _name = "res.partner.stats.mixin"
+    _description = "Agent Statistics"
+
+    # Field of res.partner.data and its hierarchy model, set by the concrete models
+    _node_field = None
+    _node_model = None
+
+    agent_type_id = fields.Many2one("agent.type", "Agent Type", readonly=True)
+    agent_count = fields.Integer("Agents", readonly=True)
+    active_agent_count = fields.Integer("Active Agents", readonly=True)
+    commission_count = fields.Integer("Commission Eligible", readonly=True)
+
+    @api.model
+    def _read_contributions(self, where, params):
+        """
+        Counts the agents matching ``where``, over res_partner_data ``d`` and
+        res_partner ``p``, per parent_path of their node and agent type
+        :return: dict of (parent_path, agent_type_id) to [agents, active agents, commission eligible]
+        """
+        self._cr.execute("""
+            SELECT n.parent_path, p.agent_type_id,
+                COUNT(*),
+                COUNT(*) FILTER (WHERE p.active_agent),
+                COUNT(*) FILTER (WHERE d.can_earn_commission)
+            FROM res_partner_data d
+            JOIN res_partner p ON p.id = d.partner_id
+            JOIN "{node_table}" n ON n.id = d."{node_field}"
+            WHERE p.is_agent AND n.parent_path IS NOT NULL AND ({where})
+            GROUP BY n.parent_path, p.agent_type_id
+        """.format(node_table=self.env[self._node_model]._table, node_field=self._node_field, where=where), params)
+        return {(path, agent_type_id): list(counts) for path, agent_type_id, *counts in self._cr.fetchall()}
+
+    @api.model
+    def _read_data_contributions(self, data_ids):
+        """
+        _read_contributions of the given res.partner.data
+        """
+        if not data_ids:
+            return {}
+        return self._read_contributions("d.id IN %s", (tuple(data_ids),))
+
+    @api.model
+    def _read_subtree_contributions(self, node_ids):
+        """
+        _read_contributions of the agents in the subtrees of the given nodes,
+        selected by their current parent_path
+        """
+        if not node_ids:
+            return {}
+        return self._read_contributions(
+            'n.parent_path LIKE ANY(SELECT m.parent_path || \'%%\' FROM "{}" m WHERE m.id IN %s)'.format(
+                self.env[self._node_model]._table
+            ), (tuple(node_ids),)
+        )
+
+    @api.model
+    def _queue_deltas(self, before, after):
+        """
+        Queues the difference between two _read_contributions results. Moving an
+        agent or a subtree shows as a decrease on the old path and an increase on
+        the new one, which cancel out on the nodes the two paths share.
+        """
+        rows = []
+        for key in set(before) | set(after):
+            old, new = before.get(key, [0, 0, 0]), after.get(key, [0, 0, 0])
+            delta = [new_count - old_count for old_count, new_count in zip(old, new)]
+            if any(delta):
+                rows.append(key + tuple(delta))
+        if not rows:
+            return
+        paths, agent_type_ids, agent_counts, active_agent_counts, commission_counts = zip(*rows)
+        self._cr.execute("""
+            INSERT INTO res_partner_stats_delta
+                (stats_model, path, agent_type_id, agent_count, active_agent_count, commission_count)
+            SELECT %s, *
+            FROM unnest(%s::varchar[], %s::integer[], %s::integer[], %s::integer[], %s::integer[])
+        """, (
+            self._name, list(paths), list(agent_type_ids), list(agent_counts), list(active_agent_counts),
+            list(commission_counts)
+        ))
+
+    @api.model
+    def _apply_deltas(self):
+        """
+        Adds the queued deltas to the rows of every node on their paths, run every
+        few minutes by cron. Only the deltas visible to this transaction are
+        consumed, later ones wait for the next run.
+        """
+        params = {"uid": self._uid, "stats_model": self._name}
+        query = """
+            WITH consumed AS (
+                DELETE FROM res_partner_stats_delta
+                WHERE stats_model = %(stats_model)s
+                RETURNING path, agent_type_id, agent_count, active_agent_count, commission_count
+            ), deltas AS (
+                SELECT n.id AS node_id, c.agent_type_id,
+                    SUM(c.agent_count) AS agent_count,
+                    SUM(c.active_agent_count) AS active_agent_count,
+                    SUM(c.commission_count) AS commission_count
+                FROM consumed c
+                CROSS JOIN unnest(string_to_array(rtrim(c.path, '/'), '/')::integer[]) AS ancestor(id)
+                JOIN "{node_table}" n ON n.id = ancestor.id
+                GROUP BY n.id, c.agent_type_id
+            ), updated AS (
+                UPDATE "{table}" s
+                SET agent_count = s.agent_count + d.agent_count,
+                    active_agent_count = s.active_agent_count + d.active_agent_count,
+                    commission_count = s.commission_count + d.commission_count,
+                    write_uid = %(uid)s, write_date = now() at time zone 'UTC'
+                FROM deltas d
+                WHERE s."{node_field}" = d.node_id AND s.agent_type_id IS NOT DISTINCT FROM d.agent_type_id
+                RETURNING s."{node_field}" AS node_id, s.agent_type_id
+            )
+            INSERT INTO "{table}" (
+                "{node_field}", agent_type_id, agent_count, active_agent_count, commission_count,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT d.node_id, d.agent_type_id, d.agent_count, d.active_agent_count, d.commission_count,
+                %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM deltas d
+            WHERE NOT EXISTS (
+                SELECT 1 FROM updated u
+                WHERE u.node_id = d.node_id AND u.agent_type_id IS NOT DISTINCT FROM d.agent_type_id
+            )
+        """
+        self._cr.execute(query.format(
+            table=self._table, node_table=self.env[self._node_model]._table, node_field=self._node_field
+        ), params)
+        self._cr.execute('DELETE FROM "%s" WHERE agent_count <= 0' % self._table)
+        self.invalidate_cache()
+
+    @api.model
+    def _rebuild(self):
+        """
+        Recounts every row, run nightly. The deltas visible to this transaction
+        are already part of the count and are dropped, those committed later are
+        applied on top of it by the next _apply_deltas
+        """
+        params = {"uid": self._uid, "stats_model": self._name}
+        self._cr.execute("DELETE FROM res_partner_stats_delta WHERE stats_model = %(stats_model)s", params)
+        self._cr.execute('DELETE FROM "%s"' % self._table)
+        self._cr.execute("""
+            INSERT INTO "{table}" (
+                "{node_field}", agent_type_id, agent_count, active_agent_count, commission_count,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT ancestor.id, p.agent_type_id,
+                COUNT(*),
+                COUNT(*) FILTER (WHERE p.active_agent),
+                COUNT(*) FILTER (WHERE d.can_earn_commission),
+                %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM res_partner_data d
+            JOIN res_partner p ON p.id = d.partner_id
+            JOIN "{node_table}" n ON n.id = d."{node_field}"
+            CROSS JOIN unnest(string_to_array(rtrim(n.parent_path, '/'), '/')::integer[]) AS ancestor(id)
+            WHERE p.is_agent
+            GROUP BY ancestor.id, p.agent_type_id
+        """.format(
+            table=self._table, node_table=self.env[self._node_model]._table, node_field=self._node_field
+        ), params)
+        self.invalidate_cache()
+
+
+class PartnerStatsDelta(models.Model):
+    """
+    Queue of agent count changes per node path, written and consumed in SQL by
+    res.partner.stats.mixin
+    """
+    _name = "res.partner.stats.delta"
+    _description = "Agent Statistics Delta"
+    _log_access = False
+
+    stats_model = fields.Char("Statistics Model", required=True, index=True)
+    path = fields.Char("Node Path", required=True)
+    agent_type_id = fields.Many2one("agent.type", "Agent Type", ondelete="set null")
+    agent_count = fields.Integer("Agents")
+    active_agent_count = fields.Integer("Active Agents")
+    commission_count = fields.Integer("Commission Eligible")
+
+
+class PartnerLocationStats(models.Model):
+    _name = "res.partner.location.stats"
+    _inherit = ["res.partner.stats.mixin"]
+    _description = "Agent Statistics per Location"
+    _rec_name = "location_id"
+
+    _node_field = "location_id"
+    _node_model = "res.partner.location"
+
+    location_id = fields.Many2one(
+        "res.partner.location", "Location", index=True, ondelete="cascade", readonly=True
+    )
+
+
+class PartnerTerritoryStats(models.Model):
+    _name = "res.partner.territory.stats"
+    _inherit = ["res.partner.stats.mixin"]
+    _description = "Agent Statistics per Territory"
+    _rec_name = "territory_id"
+
+    _node_field = "territory_id"
+    _node_model = "res.partner.territory"
+
+    territory_id = fields.Many2one(
+        "res.partner.territory", "Territory", index=True, ondelete="cascade", readonly=True
+    )
@@ -1,23 +1,36 @@
-from odoo import api, models, fields, _
-from odoo.exceptions import UserError, ValidationError
+from odoo import api, models, fields, tools, _
+from odoo.exceptions import ValidationError
 from odoo.osv import expression
 
+from .utils import check_exclude_constraints, create_trigram_index
+
 
 class PartnerTerritory(models.Model):
     _name = "res.partner.territory"
+    _inherit = ["res.partner.hierarchy.mixin"]
     _description = "Partner Territory Information"
 
     name = fields.Char("Name", required=True)
     parent_id = fields.Many2one("res.partner.territory", "Parent", index=True, ondelete="cascade")
+    territory_name = fields.Char("Display Name", compute='_compute_territory_name', store=True)
+    parent_path = fields.Char("Parent Path", compute='_compute_parent_path', store=True)
 
-    @api.constrains("name")
-    def _check_unique_name(self):
-        if self.search([("name", "=", self.name), ("id", "!=", self.id)]):
-            raise UserError(
-                _(
-                    "Territory names must be unique per Territory."
-                )
-            )
+    _sql_constraints = [
+        ('name_uniq', 'EXCLUDE USING btree (lower(name) WITH =)', 'Territory names must be unique per Territory.'),
+    ]
+
+    @api.model_cr_context
+    def _auto_init(self):
+        check_exclude_constraints(self._cr, self._table, self._sql_constraints)
+        return super(PartnerTerritory, self)._auto_init()
+
+    @api.model_cr
+    def init(self):
+        # parent_path is queried by prefix, which a default btree cannot serve
+        tools.create_index(
+            self._cr, 'res_partner_territory_parent_path_index', self._table, ['parent_path text_pattern_ops']
+        )
+        create_trigram_index(self._cr, 'res_partner_territory_territory_name_trgm_index', self._table, 'territory_name')
 
     @api.constrains('parent_id')
     def _check_category_recursion(self):
@@ -25,43 +38,85 @@ class PartnerTerritory(models.Model):
             raise ValidationError(_('Error ! You cannot create recursive categories.'))
         return True
 
+    @api.depends('parent_id.parent_path')
+    def _compute_parent_path(self):
+        """
+        Materialized ancestor path e.g 1/5/23/ for territory 23 under 5 under 1
+        :return:
+        """
+        for territory in self:
+            territory.parent_path = "%s%s/" % (territory.parent_id.parent_path or "", territory.id)
+
+    @api.depends('name', 'parent_id')
+    def _compute_territory_name(self):
+        """
+        Full path of the territory, recomputed only when the name or parent
+        changes. Descendants are updated by write()
+        :return:
+        """
+        for territory in self:
+            if territory.parent_id:
+                territory.territory_name = "%s / %s" % (territory.parent_id.territory_name, territory.name)
+            else:
+                territory.territory_name = territory.name
+
     @api.multi
-    def name_get(self):
-        def get_names(territory):
-            """ Return the list [territory.name, ...] """
-            res = []
-            while territory:
-                res.append(territory.name)
-                territory = territory.parent_id
-            return res
+    def _update_descendant_territory_names(self):
+        """
+        Rebuilds territory_name for the subtrees of self in one UPDATE from the
+        names of the ancestors listed in parent_path
+        :return:
+        """
+        if not self.ids:
+            return
+        self._cr.execute("""
+            UPDATE res_partner_territory c
+            SET territory_name = (
+                SELECT string_agg(a.name, ' / ' ORDER BY p.position)
+                FROM unnest(string_to_array(rtrim(c.parent_path, '/'), '/')::integer[])
+                    WITH ORDINALITY AS p(id, position)
+                JOIN res_partner_territory a ON a.id = p.id
+            )
+            WHERE c.parent_path LIKE ANY(
+                SELECT t.parent_path || '%%' FROM res_partner_territory t WHERE t.id IN %s
+            )
+        """, (tuple(self.ids),))
+        self.invalidate_cache(['territory_name'])
+
+    @api.multi
+    def write(self, vals):
+        # Moving subtrees moves their agents from the old ancestors' statistics to the new ones'
+        stats = self.env['res.partner.territory.stats']
+        before = stats._read_subtree_contributions(self.ids) if 'parent_id' in vals else None
+        res = super(PartnerTerritory, self).write(vals)
+        if 'name' in vals or 'parent_id' in vals:
+            self._update_descendant_territory_names()
+        if 'parent_id' in vals:
+            stats._queue_deltas(before, stats._read_subtree_contributions(self.ids))
+        return res
 
-        return [(territory.id, " / ".join(reversed(get_names(territory)))) for territory in self]
+    @api.multi
+    def unlink(self):
+        # The subtrees are deleted by the parent_id cascade and their agents lose
+        # their territory through the foreign key, so all of them leave the ancestors' statistics
+        stats = self.env['res.partner.territory.stats']
+        before = stats._read_subtree_contributions(self.ids)
+        res = super(PartnerTerritory, self).unlink()
+        stats._queue_deltas(before, {})
+        return res
+
+    @api.multi
+    def name_get(self):
+        # territory_name is the stored full path, read with the other prefetched columns
+        return [(territory.id, territory.territory_name or territory.name) for territory in self]
 
     @api.model
     def name_search(self, name, args=None, operator='ilike', limit=100):
         if not args:
             args = []
         if name:
-            # Be sure name_search is symetric to name_get
-            territory_names = name.split(' / ')
-            parents = list(territory_names)
-            child = parents.pop()
-            domain = [('name', operator, child)]
-            if parents:
-                names_ids = self.name_search(' / '.join(parents), args=args, operator='ilike', limit=limit)
-                territory_ids = [name_id[0] for name_id in names_ids]
-                if operator in expression.NEGATIVE_TERM_OPERATORS:
-                    territorys = self.search([('id', 'not in', territory_ids)])
-                    domain = expression.OR([[('parent_id', 'in', territory_ids.ids)], domain])
-                else:
-                    domain = expression.AND([[('parent_id', 'in', territory_ids)], domain])
-                for i in range(1, len(territory_names)):
-                    domain = [[('name', operator, ' / '.join(territory_names[-1 - i:]))], domain]
-                    if operator in expression.NEGATIVE_TERM_OPERATORS:
-                        domain = expression.AND(domain)
-                    else:
-                        domain = expression.OR(domain)
-            territorys = self.search(expression.AND([domain, args]), limit=limit)
+            # territory_name holds the full path, matching name_get, and is trigram indexed
+            territorys = self.search(expression.AND([[('territory_name', operator, name)], args]), limit=limit)
         else:
             territorys = self.search(args, limit=limit)
         return territorys.name_get()
@@ -0,0 +1,84 @@
+import logging
+import re
+
+import psycopg2
+
+from odoo import tools, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger("Copia Partner")
+
+
+def create_trigram_index(cr, indexname, tablename, column):
+    """
+    Create a pg_trgm GIN index on ``column`` so that ``ilike '%...%'`` searches
+    are served by the index. The index is skipped, with a warning, when the
+    extension is not available and cannot be created by the database user.
+    :return: True if the index exists
+    """
+    if tools.index_exists(cr, indexname):
+        return True
+    cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if not cr.fetchone():
+        try:
+            with cr.savepoint():
+                cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except psycopg2.Error:
+            _logger.warning("pg_trgm is not available, %s will not be created", indexname)
+            return False
+    cr.execute('CREATE INDEX "{}" ON "{}" USING gin ("{}" gin_trgm_ops)'.format(indexname, tablename, column))
+    _logger.debug("Table %r: created index %r (%s)", tablename, indexname, column)
+    return True
+
+
+def check_exclude_constraints(cr, table, sql_constraints):
+    """
+    Raise before the equality EXCLUDE constraints of ``sql_constraints`` are added
+    to ``table`` if rows already clash on them. Odoo only logs that a constraint
+    could not be added, which would leave the table without any uniqueness e.g
+    when names used to be compared case-sensitively. Constraints that already
+    exist are not checked again.
+    :raise UserError: listing the clashing rows
+    """
+    if not tools.table_exists(cr, table):
+        return
+    for key, definition, message in sql_constraints:
+        match = re.match(r"^EXCLUDE USING btree \((.*)\)$", definition)
+        if not match:
+            continue
+        cr.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", ("%s_%s" % (table, key),))
+        if cr.fetchone():
+            continue
+        exprs = [expr.strip(", ") for expr in match.group(1).split(" WITH =") if expr.strip(", ")]
+        cr.execute("""
+            SELECT string_agg(name || ' (' || id || ')', ', ' ORDER BY id)
+            FROM "{table}"
+            GROUP BY {exprs}
+            HAVING COUNT(*) > 1
+            LIMIT 20
+        """.format(table=table, exprs=", ".join(exprs)))
+        clashes = [names for names, in cr.fetchall()]
+        if clashes:
+            raise UserError(_("%s\nRename or merge these records before updating the module:\n%s") % (
+                message, "\n".join(clashes)
+            ))
+
+
+def normalize_phone(number):
+    """
+    Normalize a phone number towards E.164 e.g "+254 712-345 678" and
+    "00254712345678" both give "+254712345678". Numbers without an
+    international prefix are returned as bare digits.
+    :return: the normalized number or False
+    """
+    if not number:
+        return False
+    number = number.strip()
+    digits = re.sub(r"\D", "", number)
+    if not digits:
+        return False
+    if number.startswith("+"):
+        return "+" + digits
+    if digits.startswith("00"):
+        return "+" + digits[2:]
+    return digits
@@ -0,0 +1,7 @@
+from . import test_night_to_pay
+from . import test_location
+from . import test_child_of
+from . import test_name_uniq
+from . import test_partner_phone
+from . import test_partner_name_search
+from . import test_stats
@@ -0,0 +1,55 @@
+from odoo.tests.common import TransactionCase
+
+
+class TestChildOf(TransactionCase):
+
+    def setUp(self):
+        super(TestChildOf, self).setUp()
+        Location = self.env["res.partner.location"]
+        self.root = Location.create({"name": "Test Kenya"})
+        parent, self.chain = self.root, []
+        for depth in range(4):
+            parent = Location.create({"name": "Test Level %s" % depth, "parent_id": parent.id})
+            self.chain.append(parent)
+        outside = Location.create({"name": "Test Uganda"})
+
+        self.inside = self._create_agent("Test Agent Deep", self.chain[-1]) | self._create_agent(
+            "Test Agent Shallow", self.chain[0]
+        )
+        self.outside = self._create_agent("Test Agent Outside", outside)
+
+    def _create_agent(self, name, location):
+        partner = self.env["res.partner"].create({"name": name})
+        return self.env["res.partner.data"].create({
+            "partner_id": partner.id,
+            "location_id": location.id,
+            "latitude": -1.28333,
+            "longitude": 36.81667,
+        })
+
+    def test_child_of_single_subquery(self):
+        """ child_of compiles without searching the locations first nor listing their ids """
+        PartnerData = self.env["res.partner.data"]
+        start = self.cr.sql_log_count
+        query = PartnerData._where_calc([("location_id", "child_of", self.root.id)])
+        self.assertEqual(self.cr.sql_log_count, start, "No location search is run to compile child_of")
+
+        where_clause, where_params = query.get_sql()[1:]
+        self.assertIn("parent_path", where_clause)
+        for location in self.chain:
+            self.assertNotIn(location.id, where_params)
+
+    def test_child_of_search(self):
+        PartnerData = self.env["res.partner.data"]
+        agents = self.inside | self.outside
+        self.assertEqual(
+            PartnerData.search([("location_id", "child_of", self.root.id), ("id", "in", agents.ids)]), self.inside
+        )
+        self.assertEqual(
+            PartnerData.search([("location_id", "child_of", self.chain[1].id), ("id", "in", agents.ids)]),
+            self.inside - self.inside.filtered(lambda data: data.location_id == self.chain[0])
+        )
+        self.assertEqual(
+            PartnerData.search(["!", ("location_id", "child_of", self.root.id), ("id", "in", agents.ids)]),
+            self.outside
+        )
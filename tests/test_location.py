@@ -0,0 +1,43 @@
+from odoo.tests.common import TransactionCase
+
+
+class TestLocationAgents(TransactionCase):
+
+    def setUp(self):
+        super(TestLocationAgents, self).setUp()
+        Location = self.env["res.partner.location"]
+        root = Location.create({"name": "Test Region"})
+        self.location_ids = []
+        for index in range(5):
+            location = Location.create({"name": "Test Area %s" % index, "parent_id": root.id})
+            for agent in range(index + 1):
+                partner = self.env["res.partner"].create({"name": "Test Agent %s-%s" % (index, agent)})
+                self.env["res.partner.data"].create({
+                    "partner_id": partner.id,
+                    "location_id": location.id,
+                    "latitude": -1.28333,
+                    "longitude": 36.81667,
+                })
+            self.location_ids.append(location.id)
+        self.root = root
+
+    def _count_queries(self, location_ids):
+        # A fresh browse, so that prefetching does not compute the other locations
+        locations = self.env["res.partner.location"].browse(location_ids)
+        locations.invalidate_cache()
+        start = self.cr.sql_log_count
+        locations.mapped("agent_count")
+        locations.mapped("partner_ids")
+        return self.cr.sql_log_count - start
+
+    def test_agent_count(self):
+        """ agent_count and partner_ids cover the whole subtree """
+        self.assertEqual(self.root.agent_count, 15)
+        self.assertEqual(len(self.root.partner_ids), 15)
+        location = self.env["res.partner.location"].browse(self.location_ids[2])
+        self.assertEqual(location.agent_count, 3)
+        self.assertEqual(location.partner_ids.mapped("location_id"), location)
+
+    def test_agent_count_query_count(self):
+        """ The number of queries does not grow with the number of locations """
+        self.assertEqual(self._count_queries(self.location_ids[:1]), self._count_queries(self.location_ids))
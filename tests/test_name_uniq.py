@@ -0,0 +1,48 @@
+from psycopg2 import IntegrityError
+
+from odoo.exceptions import UserError
+from odoo.tests.common import TransactionCase
+from odoo.tools import mute_logger
+
+from odoo.addons.copia_partner.models.utils import check_exclude_constraints
+
+
+class TestNameUniq(TransactionCase):
+
+    def assertViolates(self, message, model, vals):
+        """ Creating vals violates a constraint that the server maps to message """
+        with self.cr.savepoint(), mute_logger("odoo.sql_db"), self.assertRaises(IntegrityError) as error:
+            self.env[model].create(vals)
+        self.assertEqual(self.registry._sql_error.get(error.exception.diag.constraint_name), message)
+
+    def test_location_name_per_parent(self):
+        Location = self.env["res.partner.location"]
+        region = Location.create({"name": "Test Nairobi"})
+        Location.create({"name": "Westlands", "parent_id": region.id})
+        self.assertViolates(
+            "Location names must be unique per parent Location.",
+            "res.partner.location", {"name": "westlands", "parent_id": region.id}
+        )
+        # The same name under another parent is allowed
+        Location.create({"name": "Westlands", "parent_id": Location.create({"name": "Test Mombasa"}).id})
+
+    def test_names_case_insensitive(self):
+        self.env["res.partner.territory"].create({"name": "Test Territory"})
+        self.assertViolates(
+            "Territory names must be unique per Territory.", "res.partner.territory", {"name": "TEST TERRITORY"}
+        )
+        self.env["res.partner.location.type"].create({"name": "Test Type"})
+        self.assertViolates("Location Type names must be unique.", "res.partner.location.type", {"name": "test type"})
+        self.env["agent.type"].create({"name": "Test Agent Type"})
+        self.assertViolates("Name must be unique per Agent Type", "agent.type", {"name": "test agent type"})
+
+    def test_existing_clashes_are_reported(self):
+        """ Rows clashing before the constraint is added fail the update instead of dropping the constraint """
+        LocationType = self.env["res.partner.location.type"]
+        self.cr.execute(
+            "ALTER TABLE res_partner_location_type DROP CONSTRAINT res_partner_location_type_name_uniq"
+        )
+        LocationType.create({"name": "Test Peri Urban"})
+        LocationType.create({"name": "test peri urban"})
+        with self.assertRaises(UserError):
+            check_exclude_constraints(self.cr, LocationType._table, LocationType._sql_constraints)
@@ -0,0 +1,39 @@
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+
+class TestNightToPay(TransactionCase):
+
+    def setUp(self):
+        super(TestNightToPay, self).setUp()
+        receivable = self.env["account.account"].create({
+            "code": "NTP100",
+            "name": "Night-to-Pay Receivable",
+            "user_type_id": self.env.ref("account.data_account_type_receivable").id,
+            "reconcile": True,
+        })
+        journal = self.env["account.journal"].create({"name": "Night-to-Pay Sales", "code": "NTPS", "type": "sale"})
+        partner = self.env["res.partner"].create({"name": "Night-to-Pay Agent"})
+        self.date_invoice = fields.Date.today()
+
+        # Mostly rows outside of the index predicate, which a plain date_invoice index has to filter out
+        invoice = self.env["account.invoice"]
+        for inv_type, state, count in (("out_invoice", "draft", 5), ("out_invoice", "cancel", 30),
+                                       ("out_refund", "draft", 30)):
+            for _i in range(count):
+                invoice.create({
+                    "partner_id": partner.id,
+                    "account_id": receivable.id,
+                    "journal_id": journal.id,
+                    "type": inv_type,
+                    "date_invoice": self.date_invoice,
+                }).write({"state": state})
+
+    def test_night_to_pay_uses_partial_index(self):
+        """ The Night-to-Pay aggregate is served by account_invoice_night_to_pay_index """
+        query, params = self.env["res.partner"]._get_night_to_pay_query(self.date_invoice)
+        self.env.cr.execute("ANALYZE account_invoice")
+        self.env.cr.execute("SET LOCAL enable_seqscan = off")
+        self.env.cr.execute("EXPLAIN " + query, params)
+        plan = "\n".join(line for line, in self.env.cr.fetchall())
+        self.assertIn("account_invoice_night_to_pay_index", plan)
@@ -0,0 +1,69 @@
+from odoo.tests.common import TransactionCase
+
+
+class TestPartnerNameSearch(TransactionCase):
+
+    def setUp(self):
+        super(TestPartnerNameSearch, self).setUp()
+        self.Partner = self.env["res.partner"]
+
+    def _name_search(self, name, partners, operator="ilike", args=None, model=None):
+        result = (model or self.Partner).name_search(name, [("id", "in", partners.ids)] + (args or []), operator)
+        return [partner_id for partner_id, _name in result]
+
+    def test_ranking(self):
+        """ Exact names first, then names starting with the input, then earliest and shortest matches """
+        contains = self.Partner.create({"name": "Duka la Zuberiqx"})
+        exact = self.Partner.create({"name": "Zuberiqx"})
+        starts = self.Partner.create({"name": "Zuberiqx Otieno"})
+        late = self.Partner.create({"name": "Duka Kubwa la Zuberiqx"})
+        partners = contains | exact | starts | late
+        self.assertEqual(self._name_search("zuberiqx", partners), [exact.id, starts.id, contains.id, late.id])
+        self.assertEqual(self._name_search("Zuberiqx", partners, operator="="), [exact.id])
+
+    def test_args_and_record_rules(self):
+        """ args and record rules still filter the ranked search """
+        visible = self.Partner.create({"name": "Test Kiprotich Visible"})
+        filtered = self.Partner.create({"name": "Test Kiprotich Filtered"})
+        hidden = self.Partner.create({"name": "Test Kiprotich Hidden"})
+        partners = visible | filtered | hidden
+        self.assertEqual(
+            self._name_search("kiprotich", partners, args=[("id", "!=", filtered.id)]), [hidden.id, visible.id]
+        )
+
+        user = self.env["res.users"].create({
+            "name": "Test Name Search User",
+            "login": "test_name_search_user",
+            "groups_id": [(6, 0, [self.env.ref("base.group_user").id])],
+        })
+        self.env["ir.rule"].create({
+            "name": "Test: hide partners",
+            "model_id": self.env.ref("base.model_res_partner").id,
+            "domain_force": "[('name', 'not like', 'Hidden')]",
+            "groups": [(6, 0, [self.env.ref("base.group_user").id])],
+        })
+        self.assertEqual(
+            self._name_search("kiprotich", partners, model=self.Partner.sudo(user)), [visible.id, filtered.id]
+        )
+
+    def test_phone_prefix(self):
+        """ Phone-shaped input matches normalized numbers, exact numbers first """
+        exact = self.Partner.create({"name": "Test Agent Exact", "phone": "+254712000011"})
+        prefix = self.Partner.create({"name": "Test Agent Prefix", "mobile": "+254712000012"})
+        other = self.Partner.create({"name": "Test Agent Other", "phone": "+254733000013"})
+        partners = exact | prefix | other
+        self.assertEqual(self._name_search("+254 7120", partners), [exact.id, prefix.id])
+        self.assertEqual(self._name_search("+254712000011", partners), [exact.id])
+        self.assertEqual(self._name_search("+254712000011", partners, operator="="), [exact.id])
+
+    def test_local_number(self):
+        """ A local 07... number resolves through the calling code of the company's country """
+        self.env.user.company_id.country_id = self.env.ref("base.ke")
+        partner = self.Partner.create({"name": "Test Agent Local", "phone": "+254712000021"})
+        self.assertEqual(self._name_search("0712000021", partner), [partner.id])
+        self.assertEqual(self._name_search("0712 000 021", partner, operator="="), [partner.id])
+
+    def test_digits_in_name(self):
+        """ Digits-only input still finds partners by name """
+        partner = self.Partner.create({"name": "Test Chama 2019"})
+        self.assertEqual(self._name_search("2019", partner), [partner.id])
@@ -0,0 +1,38 @@
+from odoo.exceptions import ValidationError
+from odoo.tests.common import TransactionCase
+
+
+class TestPartnerPhone(TransactionCase):
+
+    def setUp(self):
+        super(TestPartnerPhone, self).setUp()
+        self.Partner = self.env["res.partner"]
+
+    def test_duplicate_within_batch(self):
+        """ Two partners written together with the same number """
+        partners = self.Partner.create({"name": "Test Agent A", "phone": "+254712000001"}) | self.Partner.create({
+            "name": "Test Agent B", "phone": "+254712000002"
+        })
+        with self.assertRaisesRegex(ValidationError, "must be unique"):
+            partners.write({"mobile": "+254733000001"})
+
+    def test_phone_matches_other_mobile(self):
+        """ A phone clashes with another partner's mobile """
+        self.Partner.create({"name": "Test Agent A", "mobile": "+254712000003"})
+        with self.assertRaisesRegex(ValidationError, "must be unique"):
+            self.Partner.create({"name": "Test Agent B", "phone": "+254712000003"})
+
+    def test_formatted_and_plain_number(self):
+        """ Numbers are compared normalized: a formatted number stored before validation clashes with its plain form """
+        legacy = self.Partner.create({"name": "Test Legacy Agent", "phone": "+254712000004"})
+        self.cr.execute("UPDATE res_partner SET phone = %s WHERE id = %s", ("+254 712 000 004", legacy.id))
+        legacy.invalidate_cache(["phone"])
+        self.assertEqual(legacy.phone_e164, "+254712000004")
+        with self.assertRaisesRegex(ValidationError, "must be unique"):
+            self.Partner.create({"name": "Test Agent", "mobile": "+254712000004"})
+
+    def test_own_numbers_are_not_duplicates(self):
+        """ Rewriting a partner's own numbers does not clash with itself """
+        partner = self.Partner.create({"name": "Test Agent", "phone": "+254712000005", "mobile": "+254733000005"})
+        partner.write({"phone": "+254712000005", "mobile": "+254733000005"})
+        self.assertEqual(partner.mobile_e164, "+254733000005")
@@ -0,0 +1,83 @@
+from odoo.tests.common import TransactionCase
+
+
+class TestAgentStats(TransactionCase):
+
+    def setUp(self):
+        super(TestAgentStats, self).setUp()
+        self.LocationStats = self.env["res.partner.location.stats"]
+        self.TerritoryStats = self.env["res.partner.territory.stats"]
+        # Start from rows matching the data, whatever the database held before
+        self.LocationStats._rebuild()
+        self.TerritoryStats._rebuild()
+
+        Location, Territory = self.env["res.partner.location"], self.env["res.partner.territory"]
+        self.root = Location.create({"name": "Test Country"})
+        self.region = Location.create({"name": "Test Region", "parent_id": self.root.id})
+        self.town = Location.create({"name": "Test Town", "parent_id": self.region.id})
+        self.other = Location.create({"name": "Test Other Region", "parent_id": self.root.id})
+        self.territory = Territory.create({"name": "Test Territory"})
+        self.sub_territory = Territory.create({"name": "Test Sub Territory", "parent_id": self.territory.id})
+        self.agent_type = self.env["agent.type"].create({"name": "Test Stats Agent Type"})
+
+    def _create_agent(self, name, location, territory, active=False):
+        partner = self.env["res.partner"].create({
+            "name": name,
+            "is_agent": True,
+            "active_agent": active,
+            "can_purchase": active,
+            "agent_type_id": self.agent_type.id,
+        })
+        return self.env["res.partner.data"].create({
+            "partner_id": partner.id,
+            "location_id": location.id,
+            "territory_id": territory.id,
+            "latitude": -1.28333,
+            "longitude": 36.81667,
+        })
+
+    def _snapshot(self):
+        """ Statistics rows of the test agent type, per model """
+        return {
+            stats._name: sorted(
+                (row[stats._node_field][0], row["agent_count"], row["active_agent_count"], row["commission_count"])
+                for row in stats.search_read(
+                    [("agent_type_id", "=", self.agent_type.id)],
+                    [stats._node_field, "agent_count", "active_agent_count", "commission_count"]
+                )
+            ) for stats in (self.LocationStats, self.TerritoryStats)
+        }
+
+    def _assert_deltas_match_rebuild(self):
+        self.LocationStats._apply_deltas()
+        self.TerritoryStats._apply_deltas()
+        incremental = self._snapshot()
+        self.LocationStats._rebuild()
+        self.TerritoryStats._rebuild()
+        self.assertEqual(incremental, self._snapshot())
+        return incremental
+
+    def test_deltas_match_rebuild(self):
+        town_agent = self._create_agent("Test Agent Town", self.town, self.sub_territory, active=True)
+        region_agent = self._create_agent("Test Agent Region", self.region, self.territory)
+        other_agent = self._create_agent("Test Agent Other", self.other, self.sub_territory)
+        stats = self._assert_deltas_match_rebuild()
+        self.assertIn((self.root.id, 3, 1, 1), stats["res.partner.location.stats"])
+        self.assertIn((self.region.id, 2, 1, 1), stats["res.partner.location.stats"])
+
+        # Move one agent, move a subtree and flip active_agent
+        region_agent.write({"location_id": self.other.id, "territory_id": self.sub_territory.id})
+        self.town.write({"parent_id": self.other.id})
+        other_agent.partner_id.write({"active_agent": True, "can_purchase": True})
+        stats = self._assert_deltas_match_rebuild()
+        self.assertIn((self.other.id, 3, 2, 2), stats["res.partner.location.stats"])
+        self.assertNotIn(self.region.id, [row[0] for row in stats["res.partner.location.stats"]])
+
+        # Unlink an agent, a partner and a location
+        region_agent.unlink()
+        other_agent.partner_id.unlink()
+        self.town.unlink()
+        stats = self._assert_deltas_match_rebuild()
+        self.assertFalse(town_agent.location_id)
+        self.assertEqual(stats["res.partner.location.stats"], [])
+        self.assertIn((self.sub_territory.id, 1, 1, 1), stats["res.partner.territory.stats"])